@@ -1,7 +1,8 @@
 """Class tree generation and management system"""
+import functools
+import heapq
 import random
-import uuid
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from app.generator import generate_class, CLASS_TEMPLATES
 from app.utils import RARITY_WEIGHTS, weighted_rarity_choice
 from app.rules import UNLOCK_RULES
@@ -41,6 +42,95 @@ BASE_CLASSES = {
     }
 }
 
+# Key sequences and positions derived from the constant class definitions
+BASE_KEYS = tuple(BASE_CLASSES.keys())
+BASE_ORDER: Dict[str, int] = {key: i for i, key in enumerate(BASE_KEYS)}
+TEMPLATE_KEYS = tuple(CLASS_TEMPLATES.keys())
+
+# Rarity progression (10 levels)
+RARITY_LEVELS = ["Common", "Uncommon", "Magic", "Rare", "Epic", 
+                 "Unique", "Legendary", "Mythic", "God", "Forbidden"]
+
+# Precomputed rarity -> index lookups (avoids repeated list.index scans)
+RARITY_INDEX: Dict[str, int] = {rarity: i for i, rarity in enumerate(RARITY_LEVELS)}
+UNIQUE_INDEX = RARITY_INDEX["Unique"]
+MAX_RARITY_INDEX = len(RARITY_LEVELS) - 1
+
+# Parent selection weight per level: 1 / (level + 1), so lower levels are preferred
+INV_LEVEL_WEIGHT = tuple(1.0 / (level + 1) for level in range(12))
+
+# Direct-child rarity slots per base class: Common, Uncommon, and Higher (Magic or above)
+COMMON_SLOT, UNCOMMON_SLOT, HIGHER_SLOT = 0, 1, 2
+
+# Rarity -> direct-child slot (Common, Uncommon, and Magic or above -> Higher)
+RARITY_SLOT: Dict[str, int] = {rarity: min(i, HIGHER_SLOT) for i, rarity in enumerate(RARITY_LEVELS)}
+
+# Minimum requirements per base class, indexed by slot
+# Base class must have: 1 Common, 1 Uncommon, 2 higher tiers (Magic or above) DIRECTLY connected
+MIN_DIRECT_CHILDREN = (1, 1, 2)
+
+# Event types for generated unlock conditions
+EVENT_TYPES = ("read_book", "kill_monster", "craft_item", "explore", "meditate",
+               "complete_quest", "defeat_boss", "discover_secret", "master_skill")
+
+# Aggregation types for generated unlock conditions
+AGG_TYPES = ("count", "distinct_count")
+
+# Rarity choices for the first and second higher-tier (Magic or above) direct children
+FIRST_HIGHER_RARITIES = ("Magic", "Rare", "Epic")
+SECOND_HIGHER_RARITIES = tuple(RARITY_LEVELS[RARITY_INDEX["Magic"]:])
+
+# Unlock threshold range per rarity (higher rarity = higher threshold)
+BASE_THRESHOLDS = {
+    "Common": (10, 50),
+    "Uncommon": (50, 200),
+    "Magic": (200, 500),
+    "Rare": (500, 1000),
+    "Epic": (1000, 3000),
+    "Unique": (3000, 5000),
+    "Legendary": (5000, 8000),
+    "Mythic": (8000, 12000),
+    "God": (12000, 20000),
+    "Forbidden": (20000, 50000)
+}
+
+
+def _resolve_child_level_rarity(parent_level: int, parent_rarity_index: int, rarity_index: int) -> Tuple[int, int]:
+    """
+    Resolve a child's level and rarity index from its parent (pure integer logic).
+    
+    Args:
+        parent_level: Level of the parent class
+        parent_rarity_index: Index of the parent's rarity in RARITY_LEVELS
+        rarity_index: Index of the rolled child rarity in RARITY_LEVELS
+        
+    Returns:
+        Tuple of (level, rarity_index) for the child
+    """
+    # CRITICAL ENFORCEMENT: rarity_index MUST be >= parent_rarity_index
+    # If weighted_rarity_choice somehow returned a lower rarity, force it up
+    if rarity_index < parent_rarity_index:
+        rarity_index = parent_rarity_index
+    
+    # SPECIAL RULE: After Unique rarity, child MUST be higher (not same)
+    # Unique is index 5, so if parent is Unique (5) or higher, child must be > parent
+    if parent_rarity_index >= UNIQUE_INDEX and rarity_index <= parent_rarity_index:
+        # Parent is Unique or higher - child MUST be strictly higher
+        # If parent is already at max rarity it can't go higher
+        # (this shouldn't happen if Forbidden is excluded, but handle it)
+        rarity_index = min(parent_rarity_index + 1, MAX_RARITY_INDEX)
+    
+    # Adjust level to match rarity (level = rarity_index + 1)
+    # But ensure level is ALWAYS higher than parent_level (never same)
+    calculated_level = rarity_index + 1
+    if calculated_level <= parent_level:
+        # Level would be same or lower than parent - force it higher
+        calculated_level = parent_level + 1
+        # Recalculate rarity to match the higher level
+        rarity_index = min(calculated_level - 1, MAX_RARITY_INDEX)
+    
+    return min(calculated_level, 10), rarity_index  # Cap at max depth
+
 
 def generate_class_tree(num_classes: int = 50) -> Dict[str, Any]:
     """
@@ -59,43 +149,32 @@ def generate_class_tree(num_classes: int = 50) -> Dict[str, Any]:
     generated_classes = []
     unlock_rules = []
     tree_structure = {
-        "base_classes": list(BASE_CLASSES.keys()),
+        "base_classes": list(BASE_KEYS),
         "connections": []  # List of (from_class, to_class, condition_id) tuples
     }
     
-    # Event types for unlock conditions
-    event_types = ["read_book", "kill_monster", "craft_item", "explore", "meditate", 
-                   "complete_quest", "defeat_boss", "discover_secret", "master_skill"]
-    
     # Track which classes have been generated to avoid duplicates
+    # Uniqueness is enforced across ALL base classes, so the per-base subtrees are not
+    # independent and must be generated in a single loop (not in parallel workers)
     generated_class_names = set()
-    generated_class_ids = set()  # Track class IDs to prevent duplicates
+    name_counters: Dict[str, int] = {}  # Last numeric suffix used per duplicated name
+    generated_class_ids = set()  # Track class IDs to prevent duplicates (and multiple parents)
     
     # Track classes by base class and level for multi-level tree
-    class_tree_by_base = {key: [] for key in BASE_CLASSES.keys()}
-    
-    # Track which classes already have a parent (to prevent multiple parents)
-    classes_with_parents = set()  # Set of class IDs that already have a parent connection
+    class_tree_by_base = {key: [] for key in BASE_KEYS}
     
-    # Rarity progression (10 levels)
-    rarity_levels = ["Common", "Uncommon", "Magic", "Rare", "Epic", 
-                     "Unique", "Legendary", "Mythic", "God", "Forbidden"]
-    
-    # Track minimum requirements per base class
-    # Base class must have: 1 Common, 1 Uncommon, 2 higher tiers (Magic or above) DIRECTLY connected
-    min_requirements = {
-        "Common": 1,
-        "Uncommon": 1,
-        "Higher": 2  # Magic, Rare, Epic, Unique, Legendary, Mythic, God, Forbidden
-    }
+    # Index tree records and generated entries by class ID for O(1) parent lookups
+    class_by_id = {}
+    generated_by_id = {}
     
     # Track direct children of base classes (level 1 only)
-    direct_children_by_base = {key: {"Common": 0, "Uncommon": 0, "Higher": 0} 
-                                for key in BASE_CLASSES.keys()}
+    # Counts are indexed by COMMON_SLOT / UNCOMMON_SLOT / HIGHER_SLOT
+    direct_children_by_base = {key: [0, 0, 0] for key in BASE_KEYS}
     
     # Track Common-only paths for each base class
     # Each base class should have a path: base -> Common -> Common -> ... (up to depth 10)
-    common_path_by_base = {key: [] for key in BASE_CLASSES.keys()}  # List of class IDs in the Common-only path
+    common_path_by_base = {key: [] for key in BASE_KEYS}  # List of class IDs in the Common-only path
+    common_path_set_by_base = {key: set() for key in BASE_KEYS}  # Same IDs, for membership tests
     
     # Generate classes - create multi-level trees with depth up to 10
     classes_generated = 0
@@ -103,36 +182,37 @@ def generate_class_tree(num_classes: int = 50) -> Dict[str, Any]:
     max_iterations = num_classes * 10  # Increased safety limit to handle skips
     iteration = 0
     requirement_round_robin = 0  # Track which base class to work on for requirements
+    rule_counter = 0  # Monotonic counter for generated unlock rule IDs
     
-    # Continue until we have target_classes_per_base for each base class
-    def all_bases_have_enough():
-        for key in BASE_CLASSES.keys():
-            count = len([gc for gc in generated_classes 
-                        if gc["class_data"].get("base_class") == key])
-            if count < target_classes_per_base:
-                return False
-        return True
+    # Draw per-iteration random choices in batches up front (indexed by iteration - 1)
+    event_samples = random.choices(EVENT_TYPES, k=max_iterations)
+    agg_samples = random.choices(AGG_TYPES, k=max_iterations)
+    template_samples = random.choices(TEMPLATE_KEYS, k=max_iterations)
+    first_higher_samples = random.choices(FIRST_HIGHER_RARITIES, k=max_iterations)
+    second_higher_samples = random.choices(SECOND_HIGHER_RARITIES, k=max_iterations)
     
-    while not all_bases_have_enough() and iteration < max_iterations:
+    # Track classes generated per base class to ensure 50 per base
+    # Incremented once whenever a class is appended to generated_classes
+    counts_per_base = {key: 0 for key in BASE_KEYS}
+    
+    # Base classes that still need minimum requirements (in BASE_CLASSES order)
+    # Entries are removed once their last direct-child requirement is satisfied
+    bases_needing_requirements = list(BASE_KEYS)
+    
+    # Base classes that have reached target_classes_per_base
+    bases_done = {key for key in BASE_KEYS if counts_per_base[key] >= target_classes_per_base}
+    
+    # Max-heap of (-remaining, base order, base_key) so the most-behind base class is on top
+    # Entries are pushed on every increment; stale ones are discarded lazily when read
+    remaining_heap = [(-target_classes_per_base, BASE_ORDER[key], key) for key in BASE_KEYS]
+    heapq.heapify(remaining_heap)
+    
+    # Continue until we have target_classes_per_base for each base class
+    while len(bases_done) < len(BASE_KEYS) and iteration < max_iterations:
         iteration += 1
         
-        # Choose base class - prioritize ones that need minimum requirements first
-        # Find base classes that still need minimum requirements
-        bases_needing_requirements = [
-            key for key in BASE_CLASSES.keys()
-            if (direct_children_by_base[key]["Common"] < min_requirements["Common"] or
-                direct_children_by_base[key]["Uncommon"] < min_requirements["Uncommon"] or
-                direct_children_by_base[key]["Higher"] < min_requirements["Higher"])
-        ]
-        
-        # Track classes generated per base class to ensure 50 per base
-        # Count actual generated classes (not just in tree structure)
-        classes_per_base = {}
-        for key in BASE_CLASSES.keys():
-            # Count classes that have been successfully generated and added
-            classes_per_base[key] = len([gc for gc in generated_classes 
-                                        if gc["class_data"].get("base_class") == key])
-        target_classes_per_base = num_classes // len(BASE_CLASSES)  # Should be 50
+        # Parent rarity used to adjust generator weights (only set for normal generation)
+        parent_rarity_for_weights = None
         
         # Choose base class - prioritize ones that need minimum requirements first
         if bases_needing_requirements:
@@ -141,37 +221,20 @@ def generate_class_tree(num_classes: int = 50) -> Dict[str, Any]:
             requirement_round_robin += 1
         else:
             # All base classes have minimum requirements
-            # Distribute evenly, but prioritize base classes that have fewer classes
-            # Find base classes that haven't reached target yet
-            bases_below_target = [
-                key for key in BASE_CLASSES.keys()
-                if classes_per_base[key] < target_classes_per_base
-            ]
+            # Distribute evenly by always working on the base class that needs the most classes
+            while remaining_heap and -remaining_heap[0][0] != target_classes_per_base - counts_per_base[remaining_heap[0][2]]:
+                heapq.heappop(remaining_heap)
             
-            if bases_below_target:
-                # Prioritize base classes that need more classes
-                # Weight by how many classes they still need
-                weights = [(target_classes_per_base - classes_per_base[key]) for key in bases_below_target]
-                total_weight = sum(weights)
-                if total_weight > 0:
-                    rand = random.uniform(0, total_weight)
-                    cumulative = 0
-                    for i, weight in enumerate(weights):
-                        cumulative += weight
-                        if rand <= cumulative:
-                            base_class_key = bases_below_target[i]
-                            break
-                    else:
-                        base_class_key = bases_below_target[0]
-                else:
-                    base_class_key = bases_below_target[0]
+            if remaining_heap and -remaining_heap[0][0] > 0:
+                base_class_key = remaining_heap[0][2]
             else:
                 # All base classes have reached target, distribute evenly
-                base_class_key = list(BASE_CLASSES.keys())[classes_generated % len(BASE_CLASSES)]
+                base_class_key = BASE_KEYS[classes_generated % len(BASE_KEYS)]
         
         # Check if we need to build Common-only path for this base class
         # Each base class should have a path of Common classes going to depth 10
         common_path = common_path_by_base[base_class_key]
+        common_path_set = common_path_set_by_base[base_class_key]
         needs_common_path = len(common_path) < 10  # Need 10 Common classes in the path (depth 10)
         
         # Initialize Common path variables (will be set if needed)
@@ -179,9 +242,10 @@ def generate_class_tree(num_classes: int = 50) -> Dict[str, Any]:
         common_path_level = None
         
         # Check if we need to fulfill minimum requirements for DIRECT children of this base class
-        needs_common = direct_children_by_base[base_class_key]["Common"] < min_requirements["Common"]
-        needs_uncommon = direct_children_by_base[base_class_key]["Uncommon"] < min_requirements["Uncommon"]
-        needs_higher = direct_children_by_base[base_class_key]["Higher"] < min_requirements["Higher"]
+        direct_children = direct_children_by_base[base_class_key]
+        needs_common = direct_children[COMMON_SLOT] < MIN_DIRECT_CHILDREN[COMMON_SLOT]
+        needs_uncommon = direct_children[UNCOMMON_SLOT] < MIN_DIRECT_CHILDREN[UNCOMMON_SLOT]
+        needs_higher = direct_children[HIGHER_SLOT] < MIN_DIRECT_CHILDREN[HIGHER_SLOT]
         
         # Decide generation type: minimum requirements > normal generation (which includes Common path building)
         # Force specific rarity if minimum requirements not met for DIRECT children
@@ -196,14 +260,13 @@ def generate_class_tree(num_classes: int = 50) -> Dict[str, Any]:
         elif needs_higher:
             # Choose a higher tier rarity (Magic or above) - must be direct child
             # We need 2 higher tier classes, so check how many we already have
-            higher_count = direct_children_by_base[base_class_key]["Higher"]
+            higher_count = direct_children[HIGHER_SLOT]
             if higher_count == 0:
                 # First higher tier - choose a lower one (Magic, Rare, or Epic)
-                higher_rarities = ["Magic", "Rare", "Epic"]
+                target_rarity = first_higher_samples[iteration - 1]
             else:
                 # Second higher tier - can be any higher tier
-                higher_rarities = ["Magic", "Rare", "Epic", "Unique", "Legendary", "Mythic", "God", "Forbidden"]
-            target_rarity = random.choice(higher_rarities)
+                target_rarity = second_higher_samples[iteration - 1]
             must_be_direct_child = True
             build_common_path_this_iteration = False
         else:
@@ -247,10 +310,9 @@ def generate_class_tree(num_classes: int = 50) -> Dict[str, Any]:
                         build_common_path_this_iteration = True
                         common_path_parent = common_path[-1]
                         # Find parent's level
-                        parent_candidate = next((c for c in class_tree_by_base[base_class_key] 
-                                               if c["class_id"] == common_path_parent), None)
+                        parent_candidate = class_by_id.get(common_path_parent)
                         if parent_candidate:
-                            parent_level = parent_candidate.get("level", 1)
+                            parent_level = parent_candidate["level"]
                             # Always increment by exactly 1 to ensure we get every level (1-10)
                             # The path should have one class at each level
                             common_path_level = parent_level + 1
@@ -293,16 +355,16 @@ def generate_class_tree(num_classes: int = 50) -> Dict[str, Any]:
                 # Prefer classes at lower levels to build depth, but allow any level < 10
                 # EXCLUDE Forbidden classes (they are end nodes - no children)
                 available_parents = [c for c in class_tree_by_base[base_class_key] 
-                                   if c.get("level", 1) < 10 and 
-                                   c.get("rarity") != "Forbidden"]  # Max depth 10, exclude Forbidden
+                                   if c["level"] < 10 and 
+                                   c["rarity"] != "Forbidden"]  # Max depth 10, exclude Forbidden
                 if available_parents:
                     # If Common path is incomplete, give strong preference to Common path nodes
                     # This helps ensure the path gets built to level 10
                     weights = []
                     for c in available_parents:
-                        base_weight = 1.0 / (c.get("level", 1) + 1)
+                        base_weight = INV_LEVEL_WEIGHT[c["level"]]
                         # Boost weight if this is part of the Common path and path is incomplete
-                        if needs_common_path and c["class_id"] in common_path:
+                        if needs_common_path and c["class_id"] in common_path_set:
                             # Strong boost for Common path nodes, especially the last one
                             if len(common_path) > 0 and c["class_id"] == common_path[-1]:
                                 base_weight *= 3.0  # 3x boost for the last Common path node
@@ -310,32 +372,23 @@ def generate_class_tree(num_classes: int = 50) -> Dict[str, Any]:
                                 base_weight *= 2.0  # 2x boost for other Common path nodes
                         weights.append(base_weight)
                     
-                    total_weight = sum(weights)
-                    rand = random.uniform(0, total_weight)
-                    cumulative = 0
-                    parent_candidate = available_parents[0]  # Default
-                    for i, weight in enumerate(weights):
-                        cumulative += weight
-                        if rand <= cumulative:
-                            parent_candidate = available_parents[i]
-                            break
+                    parent_candidate = random.choices(available_parents, weights=weights, k=1)[0]
                     
                     parent_class = parent_candidate["class_id"]
-                    parent_level = parent_candidate.get("level", 1)
+                    parent_level = parent_candidate["level"]
                     
                     # Get parent's rarity FIRST to ensure child is same or higher
                     parent_rarity = None
                     parent_rarity_index = 0
                     if "rarity" in parent_candidate:
                         parent_rarity = parent_candidate["rarity"]
-                        parent_rarity_index = rarity_levels.index(parent_rarity) if parent_rarity in rarity_levels else 0
+                        parent_rarity_index = RARITY_INDEX.get(parent_rarity, 0)
                     else:
                         # Try to find from generated classes
-                        parent_gen_class = next((gc for gc in generated_classes 
-                                                if gc["class_data"]["id"] == parent_class), None)
+                        parent_gen_class = generated_by_id.get(parent_class)
                         if parent_gen_class:
                             parent_rarity = parent_gen_class["class_data"]["rarity"]
-                            parent_rarity_index = rarity_levels.index(parent_rarity) if parent_rarity in rarity_levels else 0
+                            parent_rarity_index = RARITY_INDEX.get(parent_rarity, 0)
                     
                     # Child must be same tier or higher than parent
                     # Level must be higher than parent to build depth (up to depth 10)
@@ -372,45 +425,11 @@ def generate_class_tree(num_classes: int = 50) -> Dict[str, Any]:
                     # This ensures percentages are adjusted (Common removed if parent is Uncommon+, etc.)
                     # IMPORTANT: weighted_rarity_choice should only return rarities >= parent_rarity
                     rarity = weighted_rarity_choice(None, parent_rarity)
-                    rarity_index = rarity_levels.index(rarity) if rarity in rarity_levels else parent_rarity_index
-                    
-                    # CRITICAL ENFORCEMENT: rarity_index MUST be >= parent_rarity_index
-                    # If weighted_rarity_choice somehow returned a lower rarity, force it up
-                    if rarity_index < parent_rarity_index:
-                        rarity_index = parent_rarity_index
-                        rarity = rarity_levels[rarity_index]
-                    
-                    # SPECIAL RULE: After Unique rarity, child MUST be higher (not same)
-                    # Unique is index 5, so if parent is Unique (5) or higher, child must be > parent
-                    unique_index = rarity_levels.index("Unique") if "Unique" in rarity_levels else 5
-                    if parent_rarity_index >= unique_index:
-                        # Parent is Unique or higher - child MUST be strictly higher
-                        if rarity_index <= parent_rarity_index:
-                            # Child is same or lower - force it to be higher
-                            if parent_rarity_index < len(rarity_levels) - 1:
-                                rarity_index = parent_rarity_index + 1
-                                rarity = rarity_levels[rarity_index]
-                            else:
-                                # Parent is already at max rarity - can't go higher
-                                # This shouldn't happen if Forbidden is excluded, but handle it
-                                rarity_index = parent_rarity_index
-                                rarity = rarity_levels[rarity_index]
-                    
-                    # Adjust level to match rarity (level = rarity_index + 1)
-                    # But ensure level is ALWAYS higher than parent_level (never same)
-                    calculated_level = rarity_index + 1
-                    if calculated_level <= parent_level:
-                        # Level would be same or lower than parent - force it higher
-                        calculated_level = parent_level + 1
-                        # Recalculate rarity to match the higher level
-                        if calculated_level <= len(rarity_levels):
-                            rarity_index = calculated_level - 1
-                            rarity = rarity_levels[rarity_index]
-                        else:
-                            rarity_index = len(rarity_levels) - 1
-                            rarity = rarity_levels[rarity_index]
+                    rarity_index = RARITY_INDEX.get(rarity, parent_rarity_index)
                     
-                    level = min(calculated_level, 10)  # Cap at max depth
+                    # Enforce parent rarity rules and derive the child's level from its rarity
+                    level, rarity_index = _resolve_child_level_rarity(parent_level, parent_rarity_index, rarity_index)
+                    rarity = RARITY_LEVELS[rarity_index]
                     
                     # Store parent rarity for weight adjustment (will be used in generate_class)
                     parent_rarity_for_weights = parent_rarity
@@ -423,74 +442,58 @@ def generate_class_tree(num_classes: int = 50) -> Dict[str, Any]:
                     parent_rarity_for_weights = None  # Base class - use normal weights
                     
                     # Choose rarity based on level
-                    if level <= len(rarity_levels):
-                        rarity = rarity_levels[level - 1]
+                    if level <= len(RARITY_LEVELS):
+                        rarity = RARITY_LEVELS[level - 1]
                     else:
                         rarity = weighted_rarity_choice()  # Fallback
         
         # Choose event type for unlock
-        event_type = random.choice(event_types)
+        event_type = event_samples[iteration - 1]
         
         # Determine threshold based on rarity and level (higher rarity = higher threshold)
-        base_thresholds = {
-            "Common": (10, 50),
-            "Uncommon": (50, 200),
-            "Magic": (200, 500),
-            "Rare": (500, 1000),
-            "Epic": (1000, 3000),
-            "Unique": (3000, 5000),
-            "Legendary": (5000, 8000),
-            "Mythic": (8000, 12000),
-            "God": (12000, 20000),
-            "Forbidden": (20000, 50000)
-        }
-        
-        threshold_range = base_thresholds.get(rarity, (10, 50))
+        threshold_range = BASE_THRESHOLDS.get(rarity, (10, 50))
         threshold = random.randint(threshold_range[0], threshold_range[1])
         
         # Use count or distinct_count
-        agg_type = random.choice(["count", "distinct_count"])
+        agg_type = agg_samples[iteration - 1]
         
         # Generate class using a random template or create a new one
-        template_key = random.choice(list(CLASS_TEMPLATES.keys()))
+        template_key = template_samples[iteration - 1]
         
-        # Create unique unlock rule ID
-        rule_id = f"unlock_gen_{uuid.uuid4().hex[:8]}"
+        # Create unique unlock rule ID (unique within this tree)
+        rule_counter += 1
+        rule_id = f"unlock_gen_{rule_counter:08x}"
         
         # Generate the class
         try:
             # If we're forcing a rarity for minimum requirements, use exact rarity
             if must_be_direct_child:
-                # Set a flag to force exact rarity in generator
-                import app.generator as gen_module
-                gen_module._force_exact_rarity = True
                 preferred_rarity_for_gen = rarity
                 # For minimum requirements, don't adjust weights (use base class)
-                gen_module._parent_rarity_for_weights = None
+                parent_rarity_for_weights = None
             else:
-                gen_module._force_exact_rarity = False
                 preferred_rarity_for_gen = None
                 # Pass parent rarity to adjust weight percentages
                 # If parent exists and is not base class, adjust weights
-                if parent_class != base_class_key and 'parent_rarity_for_weights' in locals() and parent_rarity_for_weights:
-                    gen_module._parent_rarity_for_weights = parent_rarity_for_weights
-                else:
-                    gen_module._parent_rarity_for_weights = None
+                if parent_class == base_class_key:
+                    parent_rarity_for_weights = None
             
-            class_data = generate_class(template_key, rule_id, preferred_rarity_for_gen)
+            class_data = generate_class(
+                template_key,
+                rule_id,
+                preferred_rarity_for_gen,
+                force_exact_rarity=must_be_direct_child,
+                parent_rarity_for_weights=parent_rarity_for_weights
+            )
             
             # Check if this class ID already exists (prevent duplicate classes)
+            # Every generated class gets exactly one parent connection, so this also
+            # prevents a class from ending up with multiple parents
             if class_data["id"] in generated_class_ids:
                 # This class was already generated - skip
                 # Don't increment classes_generated, but continue to try generating another
                 continue
             
-            # Check if this class already has a parent (prevent multiple parents)
-            if class_data["id"] in classes_with_parents:
-                # This class already has a parent - skip adding another connection
-                # Don't increment classes_generated, but continue to try generating another
-                continue
-            
             # CRITICAL: Override class_data rarity with our calculated rarity
             # This ensures the rarity we calculated (with parent enforcement) is used
             class_data["rarity"] = rarity
@@ -501,14 +504,15 @@ def generate_class_tree(num_classes: int = 50) -> Dict[str, Any]:
                 # Override the rarity to match what we need (safety check)
                 if class_data["rarity"] != rarity:
                     class_data["rarity"] = rarity
-                # Clear the flag
-                gen_module._force_exact_rarity = False
             
             # Ensure unique class name
             base_name = class_data["name"]
             if base_name in generated_class_names:
-                # Add suffix to make unique
-                suffix = random.randint(1, 999)
+                # Add the next free numeric suffix for this name to make it unique
+                suffix = name_counters.get(base_name, 0) + 1
+                while f"{base_name} {suffix}" in generated_class_names:
+                    suffix += 1
+                name_counters[base_name] = suffix
                 base_name = f"{base_name} {suffix}"
             
             generated_class_names.add(base_name)
@@ -539,15 +543,20 @@ def generate_class_tree(num_classes: int = 50) -> Dict[str, Any]:
                 "level": level
             }
             
-            generated_classes.append({
+            generated_entry = {
                 "class_data": class_data,
                 "unlock_rule": unlock_rule
-            })
+            }
+            generated_classes.append(generated_entry)
+            generated_by_id[class_data["id"]] = generated_entry
             
-            unlock_rules.append(unlock_rule)
+            counts_per_base[base_class_key] += 1
+            heapq.heappush(remaining_heap, (counts_per_base[base_class_key] - target_classes_per_base,
+                                            BASE_ORDER[base_class_key], base_class_key))
+            if counts_per_base[base_class_key] >= target_classes_per_base:
+                bases_done.add(base_class_key)
             
-            # Mark this class as having a parent (prevent multiple parents)
-            classes_with_parents.add(class_data["id"])
+            unlock_rules.append(unlock_rule)
             
             # Add to tree structure - all connected to base class
             tree_structure["connections"].append({
@@ -559,53 +568,61 @@ def generate_class_tree(num_classes: int = 50) -> Dict[str, Any]:
             })
             
             # Track this class in the tree
-            class_tree_by_base[base_class_key].append({
+            tree_record = {
                 "class_id": class_data["id"],
                 "level": level,
                 "parent": parent_class,
                 "rarity": rarity
-            })
+            }
+            class_tree_by_base[base_class_key].append(tree_record)
+            class_by_id[class_data["id"]] = tree_record
             
             # Update rarity counts for DIRECT children only (parent is base class)
             # IMPORTANT: Only count if parent is base class (direct child, should be level 1)
             if parent_class == base_class_key:
                 # Double-check this is actually a direct child (level 1)
-                if level == 1:
-                    if rarity == "Common":
-                        direct_children_by_base[base_class_key]["Common"] += 1
-                    elif rarity == "Uncommon":
-                        direct_children_by_base[base_class_key]["Uncommon"] += 1
-                    elif rarity in ["Magic", "Rare", "Epic", "Unique", "Legendary", "Mythic", "God", "Forbidden"]:
-                        direct_children_by_base[base_class_key]["Higher"] += 1
+                slot = RARITY_SLOT.get(rarity)
+                if level == 1 and slot is not None:
+                    direct_children[slot] += 1
+                    
+                    # Stop prioritizing this base class once all its requirements are met
+                    if (base_class_key in bases_needing_requirements and
+                            all(count >= required for count, required in zip(direct_children, MIN_DIRECT_CHILDREN))):
+                        bases_needing_requirements.remove(base_class_key)
             
             # If this is part of the Common-only path, add it to the path
             # Also check if we're extending the path naturally (parent is last in path and we're Common)
             current_path = common_path_by_base[base_class_key]
             expected_path_level = len(current_path) + 1
+            extends_common_path = False
             
             if build_common_path_this_iteration and rarity == "Common":
                 # Verify this is at the expected level for the path
                 # The path should have classes at levels 1, 2, 3, ..., 10
                 if level == expected_path_level:
-                    common_path_by_base[base_class_key].append(class_data["id"])
+                    extends_common_path = True
                 else:
                     # Level doesn't match - this shouldn't happen if logic is correct
                     # But add it anyway if it's close (within 1 level) to help complete the path
                     if abs(level - expected_path_level) <= 1 and level <= 10:
-                        common_path_by_base[base_class_key].append(class_data["id"])
+                        extends_common_path = True
             elif (not build_common_path_this_iteration and 
                   rarity == "Common" and 
-                  parent_class in current_path and 
+                  parent_class in common_path_set and 
                   len(current_path) < 10):
                 # Natural extension: parent is in Common path, we're Common, path is incomplete
                 # Check if parent is the last in the path (extending the path)
                 # And verify we're at the expected level
                 if len(current_path) > 0 and current_path[-1] == parent_class:
                     if level == expected_path_level:
-                        common_path_by_base[base_class_key].append(class_data["id"])
+                        extends_common_path = True
                     elif abs(level - expected_path_level) <= 1 and level <= 10:
                         # Close enough - add it to help complete the path
-                        common_path_by_base[base_class_key].append(class_data["id"])
+                        extends_common_path = True
+            
+            if extends_common_path:
+                current_path.append(class_data["id"])
+                common_path_set_by_base[base_class_key].add(class_data["id"])
             
             classes_generated += 1
                 
@@ -621,11 +638,13 @@ def generate_class_tree(num_classes: int = 50) -> Dict[str, Any]:
     }
 
 
+@functools.lru_cache(maxsize=128)
 def get_class_tree_for_player(player_id: str) -> Dict[str, Any]:
     """
     Get or generate the class tree for a specific player.
     In a real system, this would be stored per player/session.
-    For now, we'll generate it fresh each time.
+    For now, trees are cached in memory per player (LRU, 128 players).
+    The returned tree is shared - callers must not mutate it.
     """
     # Generate 50 classes per base class
     # 5 base classes × 50 classes = 250 total classes
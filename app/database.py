@@ -1,7 +1,10 @@
 """Database setup and session management"""
 from sqlalchemy import create_engine
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 import os
 
 # SQLite database URL (can be overridden via environment variable)
@@ -33,3 +36,33 @@ def init_db():
     """Initialize database tables"""
     Base.metadata.create_all(bind=engine)
 
+
+def insert_or_ignore(db: Session, model, **values) -> bool:
+    """
+    Insert a row unless it conflicts with an existing one (INSERT ... ON CONFLICT DO NOTHING).
+    Falls back to an INSERT inside a SAVEPOINT on databases without ON CONFLICT support.
+    The insert is not committed.
+    
+    Args:
+        db: Database session
+        model: SQLAlchemy model class to insert into
+        **values: Column values for the new row
+        
+    Returns:
+        True if a row was inserted, False if it already existed
+    """
+    dialect_name = db.get_bind().dialect.name
+    if dialect_name == "sqlite":
+        stmt = sqlite_insert(model).values(**values).on_conflict_do_nothing()
+    elif dialect_name == "postgresql":
+        stmt = postgresql_insert(model).values(**values).on_conflict_do_nothing()
+    else:
+        # Matching on every column would miss rows whose non-key values differ, so let the
+        # database's own constraints decide and roll back just this insert on conflict
+        try:
+            with db.begin_nested():
+                db.add(model(**values))
+        except IntegrityError:
+            return False
+        return True
+    return db.execute(stmt).rowcount > 0
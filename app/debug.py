@@ -1,5 +1,6 @@
 """Debug endpoints for viewing unlock rules and class relationships"""
 from fastapi import APIRouter, Depends
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from typing import Dict, List, Any, Optional
 from app.database import get_db
@@ -12,21 +13,25 @@ router = APIRouter(prefix="/debug", tags=["debug"])
 
 
 @router.get("/unlock-tree")
-async def get_unlock_tree(db: Session = Depends(get_db)):
+def get_unlock_tree(db: Session = Depends(get_db)):
     """
     Get a tree structure showing all unlock rules and their relationships.
     Returns data for visualizing the unlock system.
     """
     rules = get_rules()
     
-    # Get all unlocked classes from database to see what's been generated
-    all_unlocked_classes = db.query(PlayerClass).all()
+    # Count unlocked classes in the database (per unlock condition) to see what's been generated
+    unlock_counts = (
+        db.query(PlayerClass.unlock_condition_id, func.count(PlayerClass.id))
+        .group_by(PlayerClass.unlock_condition_id)
+        .all()
+    )
     
     # Build the tree structure
     tree_data = {
         "rules": [],
         "templates": {},
-        "unlocked_classes_count": len(all_unlocked_classes)
+        "unlocked_classes_count": sum(count for _, count in unlock_counts)
     }
     
     # Add all rules
@@ -53,16 +58,16 @@ async def get_unlock_tree(db: Session = Depends(get_db)):
         }
     
     # Count how many times each template has been unlocked
+    rule_by_id = {rule["id"]: rule for rule in rules}
     template_counts = {}
-    for pc in all_unlocked_classes:
-        if pc.unlock_condition_id:
+    for unlock_condition_id, count in unlock_counts:
+        if unlock_condition_id:
             # Find the rule that matches
-            for rule in rules:
-                if rule["id"] == pc.unlock_condition_id:
-                    template_key = rule.get("result_template")
-                    if template_key:
-                        template_counts[template_key] = template_counts.get(template_key, 0) + 1
-                    break
+            rule = rule_by_id.get(unlock_condition_id)
+            if rule:
+                template_key = rule.get("result_template")
+                if template_key:
+                    template_counts[template_key] = template_counts.get(template_key, 0) + count
     
     tree_data["template_unlock_counts"] = template_counts
     
@@ -70,12 +75,12 @@ async def get_unlock_tree(db: Session = Depends(get_db)):
 
 
 @router.get("/class-tree")
-async def get_class_tree(player_id: Optional[str] = None, db: Session = Depends(get_db)):
+def get_class_tree(player_id: Optional[str] = None, db: Session = Depends(get_db)):
     """
     Get the complete class tree with AI-generated classes.
     If player_id is provided, shows which classes they've unlocked.
     """
-    # Generate class tree
+    # Get class tree (cached per player - copy anything we modify)
     tree = get_class_tree_for_player(player_id or "default")
     
     # Get unlocked classes if player_id provided
@@ -85,9 +90,10 @@ async def get_class_tree(player_id: Optional[str] = None, db: Session = Depends(
         unlocked_class_ids = {pc.class_data.get("id") for pc in unlocked if pc.class_data}
     
     # Mark which classes are unlocked
-    for gen_class in tree["generated_classes"]:
-        class_id = gen_class["class_data"]["id"]
-        gen_class["unlocked"] = class_id in unlocked_class_ids
+    generated_classes = [
+        {**gen_class, "unlocked": gen_class["class_data"]["id"] in unlocked_class_ids}
+        for gen_class in tree["generated_classes"]
+    ]
     
-    return tree
+    return {**tree, "generated_classes": generated_classes}
 
@@ -1,12 +1,23 @@
 """Event ingestion and aggregation logic"""
+from sqlalchemy import exists, insert, update
 from sqlalchemy.orm import Session
 from sqlalchemy.orm.attributes import flag_modified
-from app.models import Player, Event, PlayerStats
-from app.unlock_engine import check_unlocks
+from app.database import insert_or_ignore
+from app.models import Player, Event, PlayerEventAgg, PlayerStats
+from app.rules import crosses_rule_threshold
+from app.unlock_engine import check_unlocks, invalidate_player_stats
 from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 
-def ingest_event(db: Session, user_id: str, event_name: str, metadata: dict = None, timestamp: datetime = None) -> Event:
+def ingest_event(
+    db: Session,
+    user_id: str,
+    event_name: str,
+    metadata: dict = None,
+    timestamp: datetime = None,
+    check_unlocks_after: bool = True
+) -> Event:
     """
     Ingest a player event and update aggregated statistics.
     
@@ -16,17 +27,14 @@ def ingest_event(db: Session, user_id: str, event_name: str, metadata: dict = No
         event_name: Name of the event
         metadata: Optional event metadata
         timestamp: Optional event timestamp (defaults to now)
+        check_unlocks_after: Evaluate unlock rules after ingesting. Pass False when ingesting a
+            series of events and call check_unlocks once at the end instead.
         
     Returns:
         Created Event object
     """
-    # Ensure player exists
-    player = db.query(Player).filter(Player.id == user_id).first()
-    if not player:
-        player = Player(id=user_id)
-        db.add(player)
-        db.commit()
-        db.refresh(player)
+    # Ensure player exists (committed with the event)
+    insert_or_ignore(db, Player, id=user_id)
     
     # Create event
     event = Event(
@@ -38,55 +46,118 @@ def ingest_event(db: Session, user_id: str, event_name: str, metadata: dict = No
     db.add(event)
     db.flush()  # Flush to get event ID, but don't commit yet
     
-    # Update aggregated stats (this will commit)
-    update_player_stats(db, user_id, event_name, metadata)
+    # Update aggregated stats (flushed, not committed)
+    previous_stats, event_stats = update_player_stats(db, user_id, event_name, [metadata])
     
-    # Commit the event as well
+    # Commit the player, event and stats in a single transaction
     db.commit()
-    db.refresh(event)
+    invalidate_player_stats(user_id)
     
-    # Check for unlocks
-    check_unlocks(db, user_id)
+    # Check for unlocks, only when this event brought a count onto a rule threshold
+    # (POST /check-unlocks still evaluates everything on demand)
+    if check_unlocks_after and crosses_rule_threshold(event_name, previous_stats, event_stats):
+        check_unlocks(db, user_id, event_name)
     
     return event
 
 
-def update_player_stats(db: Session, user_id: str, event_name: str, metadata: dict = None):
+def ingest_events(db: Session, events: List[Dict[str, Any]]) -> Tuple[int, List[str]]:
     """
-    Update aggregated player statistics for an event.
+    Ingest a batch of player events in a single transaction.
+    
+    Args:
+        db: Database session
+        events: Events as dicts with user_id, event_name and optional metadata/timestamp
+        
+    Returns:
+        (number of events ingested, list of newly generated class IDs)
+    """
+    # Ensure each player exists once
+    user_ids = {event["user_id"] for event in events}
+    for user_id in user_ids:
+        insert_or_ignore(db, Player, id=user_id)
+    
+    event_rows = []
+    metadatas_by_key: Dict[Tuple[str, str], List[Optional[dict]]] = {}
+    for event in events:
+        user_id = event["user_id"]
+        event_name = event["event_name"]
+        metadata = event.get("metadata")
+        event_rows.append({
+            "user_id": user_id,
+            "event_name": event_name,
+            "event_metadata": metadata or {},
+            "timestamp": event.get("timestamp") or datetime.utcnow()
+        })
+        metadatas_by_key.setdefault((user_id, event_name), []).append(metadata)
+    
+    # Update each (user_id, event_name) aggregate row once for all of its events
+    to_check: Set[Tuple[str, str]] = set()
+    for (user_id, event_name), metadatas in metadatas_by_key.items():
+        previous_stats, event_stats = update_player_stats(db, user_id, event_name, metadatas)
+        if crosses_rule_threshold(event_name, previous_stats, event_stats):
+            to_check.add((user_id, event_name))
+    
+    # Bulk INSERT of plain rows (no Event objects or identity-map bookkeeping)
+    if event_rows:
+        db.execute(insert(Event), event_rows)
+    
+    # Commit the players, events and stats in a single transaction
+    db.commit()
+    for user_id in user_ids:
+        invalidate_player_stats(user_id)
+    
+    # Check unlocks once per (player, event) that reached a threshold during the batch
+    newly_unlocked = []
+    for user_id, event_name in sorted(to_check):
+        newly_unlocked.extend(check_unlocks(db, user_id, event_name))
+    
+    return len(event_rows), newly_unlocked
+
+
+def update_player_stats(
+    db: Session,
+    user_id: str,
+    event_name: str,
+    metadatas: List[Optional[dict]]
+) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """
+    Update aggregated player statistics for one or more events of the same name.
+    Changes are flushed but not committed; the caller is responsible for committing.
     
     Args:
         db: Database session
         user_id: Player ID
         event_name: Event name
-        metadata: Event metadata (used for distinct counting)
+        metadatas: Metadata of each event (used for distinct counting)
+        
+    Returns:
+        ({"count": int, "distinct_count": int} before, same after) for event_name
     """
-    # Get or create player stats
-    stats = db.query(PlayerStats).filter(PlayerStats.user_id == user_id).first()
-    
-    if not stats:
-        stats = PlayerStats(user_id=user_id, event_counts={})
-        db.add(stats)
-        db.commit()
-        db.refresh(stats)
-    
-    # Get current counts - make a deep copy to avoid mutation issues
-    import copy
-    event_counts = copy.deepcopy(stats.event_counts) if stats.event_counts else {}
-    
-    # Initialize event stats if needed
-    if event_name not in event_counts:
-        event_counts[event_name] = {
-            "count": 0,
-            "distinct_count": 0,
-            "distinct_values": []
-        }
-    
-    # Update count
-    event_counts[event_name]["count"] += 1
+    # Increment in the database rather than in Python, so concurrent ingests can't lose updates
+    increment = (
+        update(PlayerEventAgg)
+        .where(PlayerEventAgg.user_id == user_id, PlayerEventAgg.event_name == event_name)
+        .values(count=PlayerEventAgg.count + len(metadatas))
+        .execution_options(synchronize_session=False)
+    )
+    if db.execute(increment).rowcount == 0:
+        # First event of this kind for the player: create the row, then increment it
+        insert_or_ignore(db, PlayerEventAgg, user_id=user_id, event_name=event_name,
+                         count=0, distinct_count=0, distinct_values=[])
+        db.execute(increment)
+    
+    # The UPDATE holds the row's write lock until commit, so this reload sees every
+    # other writer's increments and the distinct_values update below can't interleave
+    agg = db.get(PlayerEventAgg, (user_id, event_name), populate_existing=True)
+    previous_stats = {"count": agg.count - len(metadatas), "distinct_count": agg.distinct_count}
     
     # Update distinct count (if metadata has a key we track)
-    if metadata:
+    distinct_values = agg.distinct_values
+    seen = None
+    for metadata in metadatas:
+        if not metadata:
+            continue
         # For distinct counting, we'll use a key from metadata (e.g., "book_id", "item_id", "monster_id")
         # Default to first value in metadata if no specific key
         distinct_key = None
@@ -97,19 +168,53 @@ def update_player_stats(db: Session, user_id: str, event_name: str, metadata: di
         
         if not distinct_key:
             # Use first metadata value as fallback
-            distinct_key = list(metadata.values())[0] if metadata else None
+            distinct_key = list(metadata.values())[0]
         
         if distinct_key:
-            distinct_values = list(event_counts[event_name].get("distinct_values", []))
-            if distinct_key not in distinct_values:
+            if seen is None:
+                seen = set(distinct_values)
+            if distinct_key not in seen:
+                seen.add(distinct_key)
                 distinct_values.append(distinct_key)
-                event_counts[event_name]["distinct_count"] = len(distinct_values)
-                event_counts[event_name]["distinct_values"] = distinct_values
     
-    # Save updated stats - assign the new dict
-    stats.event_counts = event_counts
-    # Tell SQLAlchemy that the JSON field has been modified
-    flag_modified(stats, "event_counts")
-    db.commit()
-    db.refresh(stats)  # Ensure stats are refreshed
+    if len(distinct_values) != agg.distinct_count:
+        agg.distinct_count = len(distinct_values)
+        # Tell SQLAlchemy that the JSON field has been modified in place
+        flag_modified(agg, "distinct_values")
+        db.flush()
+    
+    return previous_stats, {"count": agg.count, "distinct_count": agg.distinct_count}
+
 
+def backfill_event_aggs(db: Session) -> int:
+    """
+    Copy legacy PlayerStats.event_counts blobs into PlayerEventAgg rows.
+    Only players without any aggregate rows are migrated, so once every legacy row
+    has been carried over this is a single query that returns nothing.
+    
+    Args:
+        db: Database session
+        
+    Returns:
+        Number of aggregate rows created
+    """
+    unmigrated = (
+        db.query(PlayerStats.user_id, PlayerStats.event_counts)
+        .filter(~exists().where(PlayerEventAgg.user_id == PlayerStats.user_id))
+        .all()
+    )
+    if not unmigrated:
+        return 0
+    
+    created = 0
+    for user_id, event_counts in unmigrated:
+        for event_name, legacy in (event_counts or {}).items():
+            distinct_values = list(legacy.get("distinct_values") or [])
+            created += insert_or_ignore(
+                db, PlayerEventAgg, user_id=user_id, event_name=event_name,
+                count=legacy.get("count", 0),
+                distinct_count=legacy.get("distinct_count", len(distinct_values)),
+                distinct_values=distinct_values
+            )
+    db.commit()
+    return created
@@ -1,10 +1,12 @@
 """Class and skill generation logic"""
-from typing import Dict, Any, List
-import uuid
+import random
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
 from app.utils import (
     weighted_rarity_choice,
     random_adjective,
     generate_class_id,
+    generate_hex_ids,
     rarity_to_stat_multiplier
 )
 
@@ -83,6 +85,31 @@ SKILL_TEMPLATES: Dict[str, List[Dict[str, Any]]] = {
 }
 
 
+# Rarity progression used for skill upgrades
+RARITY_ORDER = ("Common", "Uncommon", "Magic", "Rare", "Epic", "Unique", "Legendary", "Mythic", "God", "Forbidden")
+RARITY_INDEX: Dict[str, int] = {rarity: i for i, rarity in enumerate(RARITY_ORDER)}
+
+# Number of skills generated per class rarity (higher rarity = more skills)
+RARITY_SKILL_COUNT: Dict[str, int] = {
+    "Common": 2,
+    "Uncommon": 2,
+    "Magic": 3,
+    "Rare": 3,
+    "Epic": 3,
+    "Unique": 4,
+    "Legendary": 4,
+    "Mythic": 4,
+    "God": 5,
+    "Forbidden": 5,
+}
+
+
+@lru_cache(maxsize=32)
+def _skill_pool_for_themes(skill_themes: Tuple[str, ...]) -> Tuple[Dict[str, Any], ...]:
+    """Get the combined skill templates for a set of themes (memoized per theme tuple)"""
+    return tuple(skill for theme in skill_themes for skill in SKILL_TEMPLATES.get(theme, ()))
+
+
 def generate_skills(skill_themes: List[str], rarity: str, num_skills: int = None) -> List[Dict[str, Any]]:
     """
     Generate skills based on themes and rarity.
@@ -97,45 +124,28 @@ def generate_skills(skill_themes: List[str], rarity: str, num_skills: int = None
     """
     if num_skills is None:
         # Higher rarity = more skills
-        rarity_skill_count = {
-            "Common": 2,
-            "Uncommon": 2,
-            "Magic": 3,
-            "Rare": 3,
-            "Epic": 3,
-            "Unique": 4,
-            "Legendary": 4,
-            "Mythic": 4,
-            "God": 5,
-            "Forbidden": 5,
-        }
-        num_skills = rarity_skill_count.get(rarity, 2)
+        num_skills = RARITY_SKILL_COUNT.get(rarity, 2)
     
     # Collect all available skills from themes
-    available_skills = []
-    for theme in skill_themes:
-        if theme in SKILL_TEMPLATES:
-            available_skills.extend(SKILL_TEMPLATES[theme])
+    available_skills = _skill_pool_for_themes(tuple(skill_themes))
     
     # Select random skills (without replacement if possible)
-    import random
     selected_skills = random.sample(available_skills, min(num_skills, len(available_skills)))
     
     # Assign skill rarity (usually matches class rarity, but can vary)
     skill_rarities = [rarity] * len(selected_skills)
     # Sometimes upgrade one skill to next tier
     if len(selected_skills) > 1 and random.random() < 0.3:
-        rarity_order = ["Common", "Uncommon", "Magic", "Rare", "Epic", "Unique", "Legendary", "Mythic", "God", "Forbidden"]
-        if rarity in rarity_order:
-            idx = rarity_order.index(rarity)
-            if idx < len(rarity_order) - 1:
-                skill_rarities[0] = rarity_order[idx + 1]
+        idx = RARITY_INDEX.get(rarity)
+        if idx is not None and idx < len(RARITY_ORDER) - 1:
+            skill_rarities[0] = RARITY_ORDER[idx + 1]
     
     # Format skills
+    skill_ids = generate_hex_ids(len(selected_skills))
     formatted_skills = []
-    for skill, skill_rarity in zip(selected_skills, skill_rarities):
+    for skill, skill_rarity, skill_id in zip(selected_skills, skill_rarities, skill_ids):
         formatted_skills.append({
-            "id": f"skill_{uuid.uuid4().hex[:8]}",
+            "id": f"skill_{skill_id}",
             "name": skill["name"],
             "type": skill["type"],
             "rarity": skill_rarity,
@@ -145,7 +155,30 @@ def generate_skills(skill_themes: List[str], rarity: str, num_skills: int = None
     return formatted_skills
 
 
-def generate_class(template_key: str, unlock_condition_id: str, preferred_rarity: str = None) -> Dict[str, Any]:
+@lru_cache(maxsize=None)
+def _scaled_template_stats(template_key: str, rarity: str) -> Tuple[Tuple[Tuple[str, int], ...], Tuple[Tuple[str, int], ...]]:
+    """
+    Get a template's base stats and growth per rank scaled by the rarity multiplier.
+    Cached per (template, rarity) since the result is fully determined by them.
+    
+    Returns:
+        Tuple of (base_stats items, growth_per_rank items) as (stat, value) pairs
+    """
+    template = CLASS_TEMPLATES[template_key]
+    multiplier = rarity_to_stat_multiplier(rarity)
+    base_stats = tuple((k, int(v * multiplier)) for k, v in template["base_stats"].items())
+    growth_per_rank = tuple((k, int(v * multiplier)) for k, v in template["growth_per_rank"].items())
+    return base_stats, growth_per_rank
+
+
+def generate_class(
+    template_key: str,
+    unlock_condition_id: str,
+    preferred_rarity: str = None,
+    *,
+    force_exact_rarity: bool = False,
+    parent_rarity_for_weights: Optional[str] = None
+) -> Dict[str, Any]:
     """
     Generate a class based on a template key.
     
@@ -153,6 +186,8 @@ def generate_class(template_key: str, unlock_condition_id: str, preferred_rarity
         template_key: Key from CLASS_TEMPLATES
         unlock_condition_id: ID of the unlock condition that triggered this
         preferred_rarity: Preferred rarity (from rule or template)
+        force_exact_rarity: Use preferred_rarity as-is instead of rolling (for minimum requirements)
+        parent_rarity_for_weights: Parent class rarity used to adjust rarity weights
         
     Returns:
         Complete class dictionary
@@ -163,11 +198,6 @@ def generate_class(template_key: str, unlock_condition_id: str, preferred_rarity
     template = CLASS_TEMPLATES[template_key]
     
     # Determine rarity
-    # Check if we need to force exact rarity (for minimum requirements)
-    import app.generator as gen_module
-    force_exact_rarity = getattr(gen_module, '_force_exact_rarity', False)
-    parent_rarity_for_weights = getattr(gen_module, '_parent_rarity_for_weights', None)
-    
     if force_exact_rarity and preferred_rarity:
         # For minimum requirements, use exact rarity
         rarity = preferred_rarity
@@ -180,10 +210,10 @@ def generate_class(template_key: str, unlock_condition_id: str, preferred_rarity
         # Use parent rarity to adjust weights if available
         rarity = weighted_rarity_choice(None, parent_rarity_for_weights)
     
-    # Apply rarity multiplier to stats
-    multiplier = rarity_to_stat_multiplier(rarity)
-    base_stats = {k: int(v * multiplier) for k, v in template["base_stats"].items()}
-    growth_per_rank = {k: int(v * multiplier) for k, v in template["growth_per_rank"].items()}
+    # Apply rarity multiplier to stats (fresh dicts, since callers may modify class data)
+    base_stat_items, growth_items = _scaled_template_stats(template_key, rarity)
+    base_stats = dict(base_stat_items)
+    growth_per_rank = dict(growth_items)
     
     # Generate class name
     adjective = random_adjective()
@@ -206,6 +236,7 @@ def generate_class(template_key: str, unlock_condition_id: str, preferred_rarity
         "rarity": rarity,
         "description": description,
         "base_stats": base_stats,
+        "base_stats_total": sum(base_stats.values()),
         "growth_per_rank": growth_per_rank,
         "skills": skills,
         "unlock_condition_id": unlock_condition_id
@@ -2,19 +2,20 @@
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from contextlib import asynccontextmanager
 import os
-from app.database import get_db, init_db
+from app.database import SessionLocal, get_db, init_db
 from app.schemas import (
-    EventCreate, EventResponse, PlayerFeatures, PlayerClassResponse, UnlockCheckResponse,
+    EventCreate, EventResponse, EventBatchResponse, PlayerFeatures, PlayerClassResponse, UnlockCheckResponse,
     StoryGenerationRequest, StoryGenerationResponse
 )
 from app.models import Player, PlayerClass, PlayerStats
-from app.event_service import ingest_event
-from app.unlock_engine import check_unlocks, get_player_stats
-from app.story_service import generate_story_text
+from app.event_service import backfill_event_aggs, ingest_event, ingest_events
+from app.unlock_engine import check_unlocks, get_player_stats, get_cached_player_stats
+from app.story_service import generate_story_text, close_hf_client
 from app.debug import router as debug_router
 
 
@@ -23,8 +24,15 @@ async def lifespan(app: FastAPI):
     """Lifespan context manager for startup/shutdown events"""
     # Startup
     init_db()
+    # Stats used to live in player_stats.event_counts; carry them over to player_event_agg
+    db = SessionLocal()
+    try:
+        backfill_event_aggs(db)
+    finally:
+        db.close()
     yield
-    # Shutdown (if needed in future)
+    # Shutdown
+    await close_hf_client()
 
 
 # Initialize FastAPI app
@@ -78,6 +86,7 @@ async def root():
         "api_docs": "/docs",
         "endpoints": {
             "POST /events": "Ingest a player event",
+            "POST /events/batch": "Ingest many player events at once",
             "GET /player/{id}/features": "Get player statistics",
             "GET /player/{id}/classes": "Get unlocked classes",
             "POST /check-unlocks/{id}": "Manually trigger unlock check"
@@ -85,8 +94,11 @@ async def root():
     }
 
 
+# Routes that use the (synchronous) SQLAlchemy session are plain `def` so FastAPI
+# runs them in its threadpool instead of blocking the event loop
+
 @app.post("/events", response_model=EventResponse)
-async def create_event(event: EventCreate, db: Session = Depends(get_db)):
+def create_event(event: EventCreate, db: Session = Depends(get_db)):
     """
     Ingest a player event.
     
@@ -116,19 +128,30 @@ async def create_event(event: EventCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error ingesting event: {str(e)}")
 
 
+@app.post("/events/batch", response_model=EventBatchResponse)
+def create_events_bulk(events: List[EventCreate], db: Session = Depends(get_db)):
+    """
+    Ingest many player events with a single commit.
+    
+    Unlocks are checked once per player and event whose count reached a rule threshold.
+    """
+    try:
+        ingested, new_unlocks = ingest_events(db, [event.model_dump() for event in events])
+        return EventBatchResponse(ingested=ingested, new_unlocks=new_unlocks)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error ingesting events: {str(e)}")
+
+
 @app.get("/player/{player_id}/features", response_model=PlayerFeatures)
-async def get_player_features(player_id: str, db: Session = Depends(get_db)):
+def get_player_features(player_id: str, db: Session = Depends(get_db)):
     """
     Get player features/statistics (aggregated event counts).
     Returns empty stats if player doesn't exist yet.
     """
-    # Refresh the session to get latest data
-    db.expire_all()
+    # Cached briefly; ingest_event invalidates the entry when new events arrive
+    stats = get_cached_player_stats(db, player_id)
     
-    # Query stats fresh from database
-    stats = get_player_stats(db, player_id)
-    
-    # Convert sets to lists for JSON serialization
+    # Copy into fresh dicts so the cached entry is never handed to the response model
     serializable_stats = {}
     for event_name, data in stats.items():
         serializable_stats[event_name] = {
@@ -144,28 +167,19 @@ async def get_player_features(player_id: str, db: Session = Depends(get_db)):
 
 
 @app.get("/player/{player_id}/classes", response_model=List[PlayerClassResponse])
-async def get_player_classes(player_id: str, db: Session = Depends(get_db)):
+def get_player_classes(player_id: str, db: Session = Depends(get_db)):
     """
     Get all unlocked classes for a player.
     Returns empty list if player doesn't exist yet.
     """
     classes = db.query(PlayerClass).filter(PlayerClass.user_id == player_id).all()
     
-    result = []
-    for pc in classes:
-        result.append(PlayerClassResponse(
-            id=pc.id,
-            user_id=pc.user_id,
-            class_data=pc.class_data,
-            unlock_condition_id=pc.unlock_condition_id,
-            unlocked_at=pc.unlocked_at
-        ))
-    
-    return result
+    # Validate straight from the ORM objects (PlayerClassResponse uses from_attributes)
+    return [PlayerClassResponse.model_validate(pc) for pc in classes]
 
 
 @app.post("/check-unlocks/{player_id}", response_model=UnlockCheckResponse)
-async def check_player_unlocks(player_id: str, db: Session = Depends(get_db)):
+def check_player_unlocks(player_id: str, db: Session = Depends(get_db)):
     """
     Manually trigger unlock evaluation for a player.
     
@@ -207,7 +221,8 @@ async def generate_story(
         
         player_stats = None
         if player_id:
-            stats = get_player_stats(db, player_id)
+            # Blocking DB call - run it off the event loop
+            stats = await run_in_threadpool(get_player_stats, db, player_id)
             # Convert to serializable format
             player_stats = {}
             for event_name, data in stats.items():
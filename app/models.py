@@ -1,8 +1,9 @@
 """SQLAlchemy models for database tables"""
-from sqlalchemy import Column, String, Integer, DateTime, JSON, ForeignKey, Text
+from sqlalchemy import Column, String, Integer, DateTime, JSON, ForeignKey, Text, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.database import Base
+from app.utils import generate_sortable_id
 import uuid
 
 
@@ -18,13 +19,14 @@ class Player(Base):
     events = relationship("Event", back_populates="player")
     classes = relationship("PlayerClass", back_populates="player")
     stats = relationship("PlayerStats", back_populates="player", uselist=False)
+    event_aggs = relationship("PlayerEventAgg", back_populates="player")
 
 
 class Event(Base):
     """Event model for player actions"""
     __tablename__ = "events"
 
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, default=generate_sortable_id)  # Time-ordered for append-only inserts
     user_id = Column(String, ForeignKey("players.id"), nullable=False, index=True)
     event_name = Column(String, nullable=False, index=True)
     event_metadata = Column("metadata", JSON, nullable=True)  # Column name is "metadata" in DB, but attribute is "event_metadata"
@@ -33,9 +35,14 @@ class Event(Base):
     # Relationships
     player = relationship("Player", back_populates="events")
 
+    # Composite index for per-player, per-event lookups
+    __table_args__ = (
+        Index("ix_events_user_event", "user_id", "event_name"),
+    )
+
 
 class PlayerStats(Base):
-    """Aggregated player statistics"""
+    """Aggregated player statistics (legacy JSON blob, superseded by PlayerEventAgg)"""
     __tablename__ = "player_stats"
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
@@ -49,11 +56,25 @@ class PlayerStats(Base):
     player = relationship("Player", back_populates="stats")
 
 
+class PlayerEventAgg(Base):
+    """Per-player, per-event aggregate counts"""
+    __tablename__ = "player_event_agg"
+
+    user_id = Column(String, ForeignKey("players.id"), primary_key=True)
+    event_name = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    distinct_count = Column(Integer, nullable=False, default=0)
+    distinct_values = Column(JSON, nullable=False, default=list)  # Only read on ingest and /features
+
+    # Relationships
+    player = relationship("Player", back_populates="event_aggs")
+
+
 class PlayerClass(Base):
     """Unlocked classes for players"""
     __tablename__ = "classes"
 
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, default=generate_sortable_id)  # Time-ordered for append-only inserts
     user_id = Column(String, ForeignKey("players.id"), nullable=False, index=True)
     class_data = Column(JSON, nullable=False)  # Full class JSON
     unlock_condition_id = Column(String, nullable=True)
@@ -1,5 +1,5 @@
 """Hardcoded unlock rules"""
-from typing import Dict, Any, List
+from typing import Dict, Any, Callable, FrozenSet, List, Tuple
 
 
 # Unlock rule structure:
@@ -11,6 +11,7 @@ from typing import Dict, Any, List
 #   "result_template": str,  # Template key for class generation
 #   "preferred_rarity": str (optional)  # Preferred rarity for generated class
 # }
+# At import each rule also gets a precompiled "_check" callable (see _compile_rule)
 
 UNLOCK_RULES: List[Dict[str, Any]] = [
     {
@@ -40,15 +41,96 @@ UNLOCK_RULES: List[Dict[str, Any]] = [
 ]
 
 
-def get_rules() -> List[Dict[str, Any]]:
-    """Get all unlock rules"""
-    return UNLOCK_RULES
+# Rule lookup indices, built once at import
+_RULES_TUPLE: Tuple[Dict[str, Any], ...] = ()
+_RULES_BY_EVENT: Dict[str, Tuple[Dict[str, Any], ...]] = {}
+_RULES_BY_ID: Dict[str, Dict[str, Any]] = {}
+# Thresholds of each event's rules, per aggregation ("count" / "distinct_count")
+_THRESHOLDS_BY_EVENT: Dict[str, Dict[str, FrozenSet[int]]] = {}
 
 
-def get_rule_by_id(rule_id: str) -> Dict[str, Any]:
-    """Get a specific rule by ID"""
+def _compile_rule(rule: Dict[str, Any]) -> Callable[[Dict[str, Any]], bool]:
+    """
+    Build a specialized check for a rule, resolving its event, aggregation and threshold once.
+    
+    Args:
+        rule: Unlock rule dictionary
+        
+    Returns:
+        Callable taking player stats and returning True if the rule's conditions are met
+    """
+    event_name = rule.get("match", {}).get("event_name")
+    agg_type = rule.get("agg", "count")
+    threshold = rule.get("threshold", 0)
+    
+    if not event_name or agg_type not in ("count", "distinct_count"):
+        return lambda player_stats: False
+    
+    def check(player_stats: Dict[str, Any]) -> bool:
+        event_stats = player_stats.get(event_name)
+        return event_stats is not None and event_stats[agg_type] >= threshold
+    
+    return check
+
+
+def _build_indices() -> None:
+    """Index UNLOCK_RULES by matched event name and by rule ID"""
+    global _RULES_TUPLE
+    _RULES_TUPLE = tuple(UNLOCK_RULES)
+    _RULES_BY_EVENT.clear()
+    _RULES_BY_ID.clear()
+    _THRESHOLDS_BY_EVENT.clear()
     for rule in UNLOCK_RULES:
-        if rule["id"] == rule_id:
-            return rule
-    raise ValueError(f"Rule not found: {rule_id}")
+        rule["_check"] = _compile_rule(rule)
+        _RULES_BY_ID[rule["id"]] = rule
+        event_name = rule.get("match", {}).get("event_name")
+        if event_name:
+            _RULES_BY_EVENT[event_name] = _RULES_BY_EVENT.get(event_name, ()) + (rule,)
+    for event_name, rules in _RULES_BY_EVENT.items():
+        thresholds: Dict[str, set] = {}
+        for rule in rules:
+            thresholds.setdefault(rule.get("agg", "count"), set()).add(rule.get("threshold", 0))
+        _THRESHOLDS_BY_EVENT[event_name] = {agg: frozenset(values) for agg, values in thresholds.items()}
+
+
+_build_indices()
+
+
+def get_rules() -> Tuple[Dict[str, Any], ...]:
+    """Get all unlock rules (as an immutable tuple)"""
+    return _RULES_TUPLE
 
+
+def get_rules_for_event(event_name: str) -> Tuple[Dict[str, Any], ...]:
+    """Get the unlock rules that match an event name (empty if none do)"""
+    return _RULES_BY_EVENT.get(event_name, ())
+
+
+def crosses_rule_threshold(event_name: str, previous_stats: Dict[str, int], updated_stats: Dict[str, int]) -> bool:
+    """
+    Check whether an update moved an event's aggregates onto or past one of its rules' thresholds.
+    
+    Args:
+        event_name: Event name
+        previous_stats: {"count": int, "distinct_count": int} before the update
+        updated_stats: {"count": int, "distinct_count": int} after the update
+        
+    Returns:
+        True if an unlock check could newly succeed
+    """
+    thresholds = _THRESHOLDS_BY_EVENT.get(event_name)
+    if not thresholds:
+        return False
+    return any(
+        previous_stats.get(agg, 0) < threshold <= updated_stats.get(agg, 0)
+        for agg, values in thresholds.items()
+        for threshold in values
+    )
+
+
+def get_rule_by_id(rule_id: str) -> Dict[str, Any]:
+    """Get a specific rule by ID"""
+    try:
+        return _RULES_BY_ID[rule_id]
+    except KeyError:
+        raise ValueError(f"Rule not found: {rule_id}")
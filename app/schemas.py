@@ -1,5 +1,5 @@
 """Pydantic schemas for API requests and responses"""
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, Dict, List, Any
 from datetime import datetime
 
@@ -21,8 +21,13 @@ class EventResponse(BaseModel):
     metadata: Optional[Dict[str, Any]]
     timestamp: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, frozen=True)
+
+
+class EventBatchResponse(BaseModel):
+    """Schema for bulk event ingestion response"""
+    ingested: int
+    new_unlocks: List[str]  # List of class IDs unlocked by the batch
 
 
 # Player Stats Schemas
@@ -49,6 +54,7 @@ class ClassResponse(BaseModel):
     rarity: str
     description: str
     base_stats: Dict[str, int]
+    base_stats_total: Optional[int] = None  # Missing on classes stored before it was added
     growth_per_rank: Dict[str, int]
     skills: List[Skill]
     unlock_condition_id: str
@@ -62,8 +68,7 @@ class PlayerClassResponse(BaseModel):
     unlock_condition_id: Optional[str]
     unlocked_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, frozen=True)
 
 
 # Unlock Schemas
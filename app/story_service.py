@@ -1,8 +1,11 @@
 """AI-powered story generation service"""
+import asyncio
 import os
+import time
+from collections import OrderedDict
 import httpx
-from typing import Optional, Dict, Any
-import json
+from typing import Optional, Dict, Any, Tuple
+import orjson
 
 
 # Hugging Face Inference API endpoint (free tier)
@@ -13,12 +16,98 @@ DEFAULT_MODEL = "gpt2"  # Fast and reliable
 # Alternative model if primary fails
 FALLBACK_MODEL = "distilgpt2"
 
+# LRU + TTL cache of generated story text, keyed by (player_class, action)
+STORY_CACHE_MAXSIZE = 512
+STORY_CACHE_TTL = 3600.0  # seconds
+_story_cache: "OrderedDict[Tuple[str, Optional[str]], Tuple[float, str]]" = OrderedDict()
+# In-flight API requests per key, so concurrent identical requests share one call
+_story_inflight: Dict[Tuple[str, Optional[str]], "asyncio.Task[Optional[str]]"] = {}
+
+# Shared HTTP client so connections (and TLS sessions) are kept alive between requests
+_hf_client: Optional[httpx.AsyncClient] = None
+
+
+# Prompt building blocks, keyed by player class and action
+CLASS_DESCRIPTIONS = {
+    "warrior": "a brave warrior skilled in combat and strength",
+    "priest": "a holy priest dedicated to light, healing, and divine magic",
+    "mage": "a powerful mage who wields arcane magic and studies ancient tomes",
+    "thief": "a cunning thief who moves in shadows and excels at stealth",
+    "wanderer": "a free-spirited wanderer with no class restrictions, forging their own path"
+}
+DEFAULT_CLASS_DESCRIPTION = "an adventurer"
+
+ACTION_STORY_TEMPLATES = {
+    "read_book": "As {desc}, you open an ancient tome. The pages glow with arcane knowledge as you absorb its secrets. Describe what happens next in the story.",
+    "kill_monster": "As {desc}, you stand victorious over a fallen foe. The battle was fierce, but your skills prevailed. Continue the narrative.",
+    "craft_item": "As {desc}, you finish crafting a new item. The materials come together perfectly under your skilled hands. What happens next?",
+    "explore": "As {desc}, you venture into uncharted territory. New paths and hidden secrets reveal themselves. Describe the discovery.",
+    "meditate": "As {desc}, you find inner peace through meditation. The world fades away as you focus your mind. What insights do you gain?"
+}
+DEFAULT_ACTION_STORY_TEMPLATE = "As {desc}, you continue your journey. Write a brief, immersive story continuation (2-3 sentences)."
+
+# Starting story
+OPENING_STORY_TEMPLATE = """Write an engaging opening scene for a fantasy game. The player is {desc} beginning their journey. 
+
+Create a vivid, immersive 2-3 sentence introduction that sets the scene and invites the player into the world. Use descriptive language and create atmosphere."""
+
+# Hardcoded texts used when AI is not available
+FALLBACK_ACTION_TEXTS = {
+    "read_book": "The knowledge flows into your mind. You feel wiser and more enlightened.",
+    "kill_monster": "The battle is won! Your combat prowess grows with each victory.",
+    "craft_item": "Your creation is complete! A fine piece of work that showcases your skill.",
+    "explore": "You discover new paths and hidden secrets in the world around you.",
+    "meditate": "You feel more centered and focused after your meditation."
+}
+
+FALLBACK_CLASS_TEXTS = {
+    "warrior": "You stand at the gates of the training grounds, your sword gleaming in the sunlight. The master trainer approaches: 'Prove your worth, warrior. Your journey begins with combat.'",
+    "priest": "You enter the sacred temple, the light of the divine surrounding you. The high priest greets you: 'Welcome, child of light. Knowledge and wisdom await.'",
+    "mage": "You step into the arcane library, ancient tomes floating around you. The archmage appears: 'Magic flows through knowledge, young apprentice. Study well.'",
+    "thief": "You slip into the shadows of the city, unnoticed by all. A voice whispers: 'Stealth and cunning are your tools. Use them wisely.'",
+    "wanderer": "You walk an untrodden path, free from the constraints of tradition. A mysterious figure appears: 'You walk alone, but that is your strength. Forge your own destiny.'"
+}
+
+
+def _format_story_prompt(desc: str, action: Optional[str]) -> str:
+    """Fill the prompt template for an action (or the opening scene) with a class description"""
+    if action:
+        return ACTION_STORY_TEMPLATES.get(action, DEFAULT_ACTION_STORY_TEMPLATE).format(desc=desc)
+    return OPENING_STORY_TEMPLATE.format(desc=desc)
+
+
+# Fully formatted prompts for every known (player_class, action) pair; action None is the opening scene
+_PROMPT_TABLE = {
+    (player_class, action): _format_story_prompt(desc, action)
+    for player_class, desc in CLASS_DESCRIPTIONS.items()
+    for action in (None, *ACTION_STORY_TEMPLATES)
+}
+
 
 def get_hf_token() -> Optional[str]:
     """Get Hugging Face API token from environment"""
     return os.getenv("HUGGINGFACE_API_TOKEN") or os.getenv("HF_TOKEN")
 
 
+def get_hf_client() -> httpx.AsyncClient:
+    """Get the shared Hugging Face HTTP client, creating it on first use"""
+    global _hf_client
+    if _hf_client is None or _hf_client.is_closed:
+        _hf_client = httpx.AsyncClient(
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+        )
+    return _hf_client
+
+
+async def close_hf_client() -> None:
+    """Close the shared HTTP client (called on app shutdown)"""
+    global _hf_client
+    if _hf_client is not None:
+        await _hf_client.aclose()
+        _hf_client = None
+
+
 async def generate_story_text(
     context: str,
     player_class: str,
@@ -45,66 +134,122 @@ async def generate_story_text(
         return get_fallback_text(player_class, action)
     
     try:
-        # Build prompt
-        prompt = build_story_prompt(context, player_class, action, player_stats)
+        # The prompt depends only on class and action, so that is the cache key
+        key = (player_class, action)
+        story = _get_cached_story(key)
+        if story is not None:
+            return story
+        
+        # Coalesce concurrent identical requests onto a single API call
+        task = _story_inflight.get(key)
+        if task is None:
+            prompt = build_story_prompt(context, player_class, action, player_stats)
+            task = asyncio.create_task(_generate_and_cache_story(key, prompt, hf_token))
+            _story_inflight[key] = task
+            task.add_done_callback(lambda _: _story_inflight.pop(key, None))
         
+        # Shield so one cancelled caller doesn't cancel the shared request
+        story = await asyncio.shield(task)
+        if story:
+            return story
+    except Exception as e:
+        print(f"Error generating story with AI: {e}")
+    
+    # Fallback to hardcoded text
+    return get_fallback_text(player_class, action)
+
+
+def _get_cached_story(key: Tuple[str, Optional[str]]) -> Optional[str]:
+    """Get a cached story for (player_class, action), or None if missing or expired"""
+    cached = _story_cache.get(key)
+    if cached is None:
+        return None
+    if cached[0] <= time.monotonic():
+        del _story_cache[key]
+        return None
+    _story_cache.move_to_end(key)
+    return cached[1]
+
+
+async def _generate_and_cache_story(key: Tuple[str, Optional[str]], prompt: str, hf_token: str) -> Optional[str]:
+    """Call the API and cache a successful result (failures are not cached)"""
+    story = await request_story_from_hf(prompt, hf_token)
+    if story:
+        _story_cache[key] = (time.monotonic() + STORY_CACHE_TTL, story)
+        _story_cache.move_to_end(key)
+        while len(_story_cache) > STORY_CACHE_MAXSIZE:
+            _story_cache.popitem(last=False)
+    return story
+
+
+async def request_story_from_hf(prompt: str, hf_token: str) -> Optional[str]:
+    """
+    Request story text from the Hugging Face Inference API.
+    
+    Args:
+        prompt: Story prompt
+        hf_token: Hugging Face API token
+        
+    Returns:
+        Cleaned generated text, or None if both models failed
+    """
+    try:
         # Call Hugging Face API
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            headers = {"Authorization": f"Bearer {hf_token}"}
-            
-            # Try primary model first
-            try:
-                response = await client.post(
-                    f"{HF_API_BASE}/{DEFAULT_MODEL}",
-                    headers=headers,
-                    json={
-                        "inputs": prompt,
-                        "parameters": {
-                            "max_new_tokens": 150,
-                            "temperature": 0.8,
-                            "top_p": 0.9,
-                            "return_full_text": False
-                        }
+        client = get_hf_client()
+        headers = {"Authorization": f"Bearer {hf_token}"}
+        
+        # Try primary model first
+        try:
+            response = await client.post(
+                f"{HF_API_BASE}/{DEFAULT_MODEL}",
+                headers=headers,
+                json={
+                    "inputs": prompt,
+                    "parameters": {
+                        "max_new_tokens": 150,
+                        "temperature": 0.8,
+                        "top_p": 0.9,
+                        "return_full_text": False
                     }
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    if isinstance(result, list) and len(result) > 0:
-                        generated_text = result[0].get("generated_text", "")
-                        # Clean up the text
-                        return clean_generated_text(generated_text)
-            except Exception:
-                pass
+                }
+            )
             
-            # Fallback to simpler model if primary fails
-            try:
-                response = await client.post(
-                    f"{HF_API_BASE}/{FALLBACK_MODEL}",
-                    headers=headers,
-                    json={
-                        "inputs": prompt,
-                        "parameters": {
-                            "max_new_tokens": 100,
-                            "temperature": 0.8,
-                            "return_full_text": False
-                        }
+            if response.status_code == 200:
+                result = orjson.loads(response.content)
+                if isinstance(result, list) and len(result) > 0:
+                    generated_text = result[0].get("generated_text", "")
+                    # Clean up the text
+                    return clean_generated_text(generated_text)
+        except Exception:
+            pass
+        
+        # Fallback to simpler model if primary fails
+        try:
+            response = await client.post(
+                f"{HF_API_BASE}/{FALLBACK_MODEL}",
+                headers=headers,
+                json={
+                    "inputs": prompt,
+                    "parameters": {
+                        "max_new_tokens": 100,
+                        "temperature": 0.8,
+                        "return_full_text": False
                     }
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    if isinstance(result, list) and len(result) > 0:
-                        generated_text = result[0].get("generated_text", "")
-                        return clean_generated_text(generated_text)
-            except Exception:
-                pass
-                
+                }
+            )
+            
+            if response.status_code == 200:
+                result = orjson.loads(response.content)
+                if isinstance(result, list) and len(result) > 0:
+                    generated_text = result[0].get("generated_text", "")
+                    return clean_generated_text(generated_text)
+        except Exception:
+            pass
+            
     except Exception as e:
         print(f"Error generating story with AI: {e}")
     
-    # Fallback to hardcoded text
-    return get_fallback_text(player_class, action)
+    return None
 
 
 def build_story_prompt(
@@ -114,30 +259,9 @@ def build_story_prompt(
     player_stats: Optional[Dict[str, Any]]
 ) -> str:
     """Build a prompt for story generation"""
-    class_descriptions = {
-        "warrior": "a brave warrior skilled in combat and strength",
-        "priest": "a holy priest dedicated to light, healing, and divine magic",
-        "mage": "a powerful mage who wields arcane magic and studies ancient tomes",
-        "thief": "a cunning thief who moves in shadows and excels at stealth",
-        "wanderer": "a free-spirited wanderer with no class restrictions, forging their own path"
-    }
-    
-    # Build a more narrative prompt
-    if action:
-        action_stories = {
-            "read_book": f"As {class_descriptions.get(player_class, 'an adventurer')}, you open an ancient tome. The pages glow with arcane knowledge as you absorb its secrets. Describe what happens next in the story.",
-            "kill_monster": f"As {class_descriptions.get(player_class, 'an adventurer')}, you stand victorious over a fallen foe. The battle was fierce, but your skills prevailed. Continue the narrative.",
-            "craft_item": f"As {class_descriptions.get(player_class, 'an adventurer')}, you finish crafting a new item. The materials come together perfectly under your skilled hands. What happens next?",
-            "explore": f"As {class_descriptions.get(player_class, 'an adventurer')}, you venture into uncharted territory. New paths and hidden secrets reveal themselves. Describe the discovery.",
-            "meditate": f"As {class_descriptions.get(player_class, 'an adventurer')}, you find inner peace through meditation. The world fades away as you focus your mind. What insights do you gain?"
-        }
-        prompt = action_stories.get(action, f"As {class_descriptions.get(player_class, 'an adventurer')}, you continue your journey. Write a brief, immersive story continuation (2-3 sentences).")
-    else:
-        # Starting story
-        prompt = f"""Write an engaging opening scene for a fantasy game. The player is {class_descriptions.get(player_class, 'an adventurer')} beginning their journey. 
-
-Create a vivid, immersive 2-3 sentence introduction that sets the scene and invites the player into the world. Use descriptive language and create atmosphere."""
-    
+    prompt = _PROMPT_TABLE.get((player_class, action or None))
+    if prompt is None:
+        prompt = _format_story_prompt(CLASS_DESCRIPTIONS.get(player_class, DEFAULT_CLASS_DESCRIPTION), action)
     return prompt
 
 
@@ -148,9 +272,8 @@ def clean_generated_text(text: str) -> str:
     # Remove quotes if the entire text is quoted
     if text.startswith('"') and text.endswith('"'):
         text = text[1:-1]
-    # Capitalize first letter
-    if text:
-        text = text[0].upper() + text[1:] if len(text) > 1 else text.upper()
+    # Capitalize first letter (slicing handles empty and 1-char text)
+    text = text[:1].upper() + text[1:]
     # Ensure it ends with punctuation
     if text and text[-1] not in ".!?":
         text += "."
@@ -160,22 +283,7 @@ def clean_generated_text(text: str) -> str:
 def get_fallback_text(player_class: str, action: Optional[str] = None) -> str:
     """Fallback hardcoded text when AI is not available"""
     if action:
-        action_texts = {
-            "read_book": "The knowledge flows into your mind. You feel wiser and more enlightened.",
-            "kill_monster": "The battle is won! Your combat prowess grows with each victory.",
-            "craft_item": "Your creation is complete! A fine piece of work that showcases your skill.",
-            "explore": "You discover new paths and hidden secrets in the world around you.",
-            "meditate": "You feel more centered and focused after your meditation."
-        }
-        return action_texts.get(action, "You continue your journey...")
+        return FALLBACK_ACTION_TEXTS.get(action, "You continue your journey...")
     
     # Class-specific starting text
-    class_texts = {
-        "warrior": "You stand at the gates of the training grounds, your sword gleaming in the sunlight. The master trainer approaches: 'Prove your worth, warrior. Your journey begins with combat.'",
-        "priest": "You enter the sacred temple, the light of the divine surrounding you. The high priest greets you: 'Welcome, child of light. Knowledge and wisdom await.'",
-        "mage": "You step into the arcane library, ancient tomes floating around you. The archmage appears: 'Magic flows through knowledge, young apprentice. Study well.'",
-        "thief": "You slip into the shadows of the city, unnoticed by all. A voice whispers: 'Stealth and cunning are your tools. Use them wisely.'",
-        "wanderer": "You walk an untrodden path, free from the constraints of tradition. A mysterious figure appears: 'You walk alone, but that is your strength. Forge your own destiny.'"
-    }
-    return class_texts.get(player_class, "Your adventure begins...")
-
+    return FALLBACK_CLASS_TEXTS.get(player_class, "Your adventure begins...")
@@ -1,43 +1,110 @@
 """Unlock evaluation engine"""
-from typing import List, Dict, Any, Set
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Set, Tuple
 from sqlalchemy.orm import Session
-from app.models import Player, PlayerStats, PlayerClass
-from app.rules import get_rules
+from app.database import insert_or_ignore
+from app.models import Player, PlayerEventAgg, PlayerClass
+from app.rules import get_rules, get_rules_for_event
 from app.generator import generate_class
 import json
+import threading
+import time
 
 
-def get_player_stats(db: Session, user_id: str) -> Dict[str, Any]:
+# Short-lived LRU cache of aggregated stats for read endpoints, keyed by user_id
+# Entries are (expires_at, stats) and are invalidated when a new event is ingested
+PLAYER_STATS_CACHE_MAXSIZE = 1024
+PLAYER_STATS_CACHE_TTL = 5.0  # seconds
+_player_stats_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+# Sync routes run in a threadpool, so guard the OrderedDict's reordering
+_player_stats_cache_lock = threading.Lock()
+
+# Key in Session.info holding the rule IDs each player has already unlocked.
+# Scoped to the session (one request) so it can never outlive the rows it mirrors
+_UNLOCK_CACHE_KEY = "unlocked_rule_ids"
+
+
+def get_player_stats(db: Session, user_id: str, include_distinct_values: bool = False) -> Dict[str, Any]:
     """
     Get aggregated player statistics.
     
+    Args:
+        db: Database session
+        user_id: Player ID
+        include_distinct_values: Also return each event's stored distinct_values list.
+            Rules only need the counts, so this is off for unlock checks.
+    
     Returns:
-        Dictionary with event counts: {"event_name": {"count": int, "distinct_count": int, "distinct_values": set}}
+        Dictionary with event counts: {"event_name": {"count": int, "distinct_count": int}}
+        (plus "distinct_values": list when include_distinct_values is set)
     """
-    # Get or create player stats - refresh to get latest data
-    stats = db.query(PlayerStats).filter(PlayerStats.user_id == user_id).first()
-    
-    if not stats:
-        return {}
+    # Read plain int columns; distinct_values JSON is only loaded when asked for
+    columns = [PlayerEventAgg.event_name, PlayerEventAgg.count, PlayerEventAgg.distinct_count]
+    if include_distinct_values:
+        columns.append(PlayerEventAgg.distinct_values)
+    rows = db.query(*columns).filter(PlayerEventAgg.user_id == user_id).all()
     
-    # Refresh the object to ensure we have latest data
-    db.refresh(stats)
-    
-    # Convert JSON back to proper format (sets need special handling)
-    event_counts = stats.event_counts or {}
-    
-    # Convert distinct_values lists back to sets for processing
     processed_counts = {}
-    for event_name, data in event_counts.items():
-        processed_counts[event_name] = {
-            "count": data.get("count", 0),
-            "distinct_count": data.get("distinct_count", 0),
-            "distinct_values": set(data.get("distinct_values", []))
+    for event_name, count, distinct_count, *distinct_values in rows:
+        event_stats = {
+            "count": count,
+            "distinct_count": distinct_count
         }
+        if include_distinct_values:
+            event_stats["distinct_values"] = distinct_values[0] or []
+        processed_counts[event_name] = event_stats
     
     return processed_counts
 
 
+def get_cached_player_stats(db: Session, user_id: str) -> Dict[str, Any]:
+    """
+    Get aggregated player statistics, served from a short-TTL in-memory cache.
+    Intended for read-only endpoints; the returned dict must not be mutated.
+    """
+    now = time.monotonic()
+    with _player_stats_cache_lock:
+        cached = _player_stats_cache.get(user_id)
+        if cached and cached[0] > now:
+            _player_stats_cache.move_to_end(user_id)
+            return cached[1]
+    
+    stats = get_player_stats(db, user_id, include_distinct_values=True)
+    with _player_stats_cache_lock:
+        _player_stats_cache[user_id] = (now + PLAYER_STATS_CACHE_TTL, stats)
+        _player_stats_cache.move_to_end(user_id)
+        while len(_player_stats_cache) > PLAYER_STATS_CACHE_MAXSIZE:
+            _player_stats_cache.popitem(last=False)
+    return stats
+
+
+def invalidate_player_stats(user_id: str) -> None:
+    """Drop a player's cached stats (call after their stats change)"""
+    with _player_stats_cache_lock:
+        _player_stats_cache.pop(user_id, None)
+
+
+def _get_existing_unlocks(db: Session, user_id: str) -> Set[str]:
+    """
+    Get the set of unlock_condition_ids a player already has, cached on the session.
+    
+    Args:
+        db: Database session
+        user_id: Player ID
+        
+    Returns:
+        Set of unlocked rule IDs, shared by later checks in the same session
+    """
+    session_cache = db.info.setdefault(_UNLOCK_CACHE_KEY, {})
+    existing_unlocks = session_cache.get(user_id)
+    if existing_unlocks is None:
+        # Select just the column instead of hydrating PlayerClass objects
+        rows = db.query(PlayerClass.unlock_condition_id).filter(PlayerClass.user_id == user_id).all()
+        existing_unlocks = {unlock_condition_id for (unlock_condition_id,) in rows if unlock_condition_id}
+        session_cache[user_id] = existing_unlocks
+    return existing_unlocks
+
+
 def evaluate_rule(rule: Dict[str, Any], player_stats: Dict[str, Any]) -> bool:
     """
     Evaluate if a player meets the conditions for an unlock rule.
@@ -56,7 +123,7 @@ def evaluate_rule(rule: Dict[str, Any], player_stats: Dict[str, Any]) -> bool:
         return False
     
     # Get stats for this event
-    event_stats = player_stats.get(event_name, {"count": 0, "distinct_count": 0, "distinct_values": set()})
+    event_stats = player_stats.get(event_name, {"count": 0, "distinct_count": 0})
     
     # Check aggregation type
     agg_type = rule.get("agg", "count")
@@ -70,40 +137,39 @@ def evaluate_rule(rule: Dict[str, Any], player_stats: Dict[str, Any]) -> bool:
         return False
 
 
-def check_unlocks(db: Session, user_id: str) -> List[str]:
+def check_unlocks(db: Session, user_id: str, event_name: Optional[str] = None) -> List[str]:
     """
-    Check all unlock rules for a player and generate classes for newly unlocked ones.
+    Check unlock rules for a player and generate classes for newly unlocked ones.
     
     Args:
         db: Database session
         user_id: Player ID
+        event_name: Event that triggered the check; only rules matching it are evaluated.
+            If None, all rules are evaluated (manual check).
         
     Returns:
         List of newly generated class IDs
     """
+    # Fast path: no DB work when no rule for this event can fire
+    if event_name and not get_rules_for_event(event_name):
+        return []
+    
     # Ensure player exists
-    player = db.query(Player).filter(Player.id == user_id).first()
-    if not player:
-        player = Player(id=user_id)
-        db.add(player)
+    if insert_or_ignore(db, Player, id=user_id):
         db.commit()
-        db.refresh(player)
     
     # Get player stats
     player_stats = get_player_stats(db, user_id)
     
-    # Get all rules
-    rules = get_rules()
+    # Only rules matching the triggering event can change state
+    rules = get_rules_for_event(event_name) if event_name else get_rules()
     
     # Get already unlocked class condition IDs
-    existing_unlocks = {
-        pc.unlock_condition_id 
-        for pc in db.query(PlayerClass).filter(PlayerClass.user_id == user_id).all()
-        if pc.unlock_condition_id
-    }
+    existing_unlocks = _get_existing_unlocks(db, user_id)
     
     # Check each rule
     newly_unlocked = []
+    newly_unlocked_rule_ids = []
     for rule in rules:
         rule_id = rule["id"]
         
@@ -111,8 +177,8 @@ def check_unlocks(db: Session, user_id: str) -> List[str]:
         if rule_id in existing_unlocks:
             continue
         
-        # Evaluate rule
-        if evaluate_rule(rule, player_stats):
+        # Evaluate rule (precompiled at import, see rules._compile_rule)
+        if rule["_check"](player_stats):
             # Generate class
             template_key = rule.get("result_template")
             preferred_rarity = rule.get("preferred_rarity")
@@ -127,10 +193,13 @@ def check_unlocks(db: Session, user_id: str) -> List[str]:
                     unlock_condition_id=rule_id
                 )
                 db.add(player_class)
-                db.commit()
-                db.refresh(player_class)
-                
+                newly_unlocked_rule_ids.append(rule_id)
                 newly_unlocked.append(class_data["id"])
     
+    # Write all new unlocks in a single transaction
+    if newly_unlocked:
+        db.commit()
+        existing_unlocks.update(newly_unlocked_rule_ids)
+    
     return newly_unlocked
 
@@ -1,6 +1,9 @@
 """Utility functions for rarity, random generation, etc."""
+import os
 import random
-from typing import List, Dict, Optional
+import time
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple
 
 
 # Rarity system with weights
@@ -25,40 +28,44 @@ ADJECTIVES = [
 ]
 
 
-def weighted_rarity_choice(preferred_rarity: Optional[str] = None, parent_rarity: Optional[str] = None) -> str:
+# Derived rarity tables, built once at import
+_RARITY_ORDER = tuple(RARITY_WEIGHTS)
+_RARITY_INDEX = {rarity: i for i, rarity in enumerate(_RARITY_ORDER)}
+_UNIQUE_INDEX = _RARITY_INDEX.get("Unique", 5)
+
+
+@lru_cache(maxsize=128)
+def _rarity_weight_table(preferred_rarity: Optional[str], parent_rarity: Optional[str]) -> Tuple[Tuple[str, ...], Tuple[float, ...]]:
     """
-    Select a rarity based on weights, with optional bias toward preferred rarity.
-    If parent_rarity is provided, removes all rarities lower than parent and redistributes weights.
+    Build the selectable rarities and their cumulative weights for a (preferred, parent) pair.
+    Memoized: the result depends only on the arguments and the constant RARITY_WEIGHTS.
     
     Args:
-        preferred_rarity: If provided, increases weight by 50% for that rarity
-        parent_rarity: If provided, removes all rarities lower than this and redistributes weights
+        preferred_rarity: Rarity whose weight is boosted by 50%
+        parent_rarity: Rarities below this one are removed and their weight redistributed
         
     Returns:
-        Selected rarity string
+        (rarities, cumulative_weights) tuples; both empty if nothing is selectable.
+        rarities already has the after-Unique promotion applied.
     """
     weights = RARITY_WEIGHTS.copy()
     
     # If parent_rarity is provided, remove all rarities lower than parent
     # and redistribute the percentages proportionally
-    if parent_rarity and parent_rarity in RARITY_WEIGHTS:
-        # Get the order of rarities
-        rarity_order = list(RARITY_WEIGHTS.keys())
-        parent_index = rarity_order.index(parent_rarity)
+    if parent_rarity in _RARITY_INDEX:
+        parent_index = _RARITY_INDEX[parent_rarity]
         
         # Remove all rarities below parent's rarity (set weight to 0)
         # CRITICAL: Only keep rarities at parent_index or higher
-        for i in range(parent_index):
-            lower_rarity = rarity_order[i]
-            if lower_rarity in weights:
-                weights[lower_rarity] = 0
+        for lower_rarity in _RARITY_ORDER[:parent_index]:
+            weights[lower_rarity] = 0
         
         # Calculate total of remaining (non-zero) weights (parent and above only)
         remaining_weights = {k: v for k, v in weights.items() if v > 0}
         remaining_total = sum(remaining_weights.values())
         
         # Calculate what was removed
-        removed_total = sum(RARITY_WEIGHTS[r] for r in rarity_order[:parent_index])
+        removed_total = sum(RARITY_WEIGHTS[r] for r in _RARITY_ORDER[:parent_index])
         
         # Redistribute the removed weights proportionally to remaining rarities
         if remaining_total > 0 and removed_total > 0:
@@ -68,11 +75,8 @@ def weighted_rarity_choice(preferred_rarity: Optional[str] = None, parent_rarity
             for rarity in remaining_weights.keys():
                 weights[rarity] = weights[rarity] * scale_factor
         
-        # Final safety: ensure no lower rarities can be selected
-        # Double-check that all rarities below parent are zero
-        for i in range(parent_index):
-            lower_rarity = rarity_order[i]
-            weights[lower_rarity] = 0
+        # Zeroed weights are what keep lower rarities out of the selection below
+        assert all(weights[r] == 0 for r in _RARITY_ORDER[:parent_index])
     
     if preferred_rarity and preferred_rarity in weights and weights[preferred_rarity] > 0:
         # Boost preferred rarity by 50%
@@ -82,80 +86,71 @@ def weighted_rarity_choice(preferred_rarity: Optional[str] = None, parent_rarity
         if total > 0:
             weights = {k: v / total * 100 for k, v in weights.items()}
     
-    # Filter out zero weights and convert to cumulative weights
-    # IMPORTANT: Only include rarities that are >= parent_rarity
+    # Filter out zero weights (this also drops everything below parent_rarity)
     rarities = [r for r in weights.keys() if weights[r] > 0]
     
-    # Final safety check: if parent_rarity is provided, ensure we only have rarities >= parent
-    if parent_rarity and parent_rarity in RARITY_WEIGHTS:
-        rarity_order = list(RARITY_WEIGHTS.keys())
-        parent_index = rarity_order.index(parent_rarity)
-        # Filter to only include rarities at parent_index or higher
-        rarities = [r for r in rarities if r in rarity_order and rarity_order.index(r) >= parent_index]
-    
-    if not rarities:
-        # Fallback: if all weights are zero, use parent rarity or highest available
-        if parent_rarity:
-            return parent_rarity
-        return list(RARITY_WEIGHTS.keys())[-1]
-    
     # Build cumulative weights only from valid rarities
     cumulative_weights = []
     cumulative = 0
     for rarity in rarities:
-        if weights[rarity] > 0:  # Double-check weight is positive
-            cumulative += weights[rarity]
-            cumulative_weights.append(cumulative)
+        cumulative += weights[rarity]
+        cumulative_weights.append(cumulative)
+    
+    # SPECIAL RULE: After Unique, must be strictly higher (not same)
+    # Depends only on parent_rarity, so the promotion is baked into the population
+    if parent_rarity in _RARITY_INDEX:
+        parent_index = _RARITY_INDEX[parent_rarity]
+        if parent_index >= _UNIQUE_INDEX:
+            # Parent is Unique or higher - same or lower is forced one step higher (if possible)
+            promoted = _RARITY_ORDER[min(parent_index + 1, len(_RARITY_ORDER) - 1)]
+            rarities = [promoted if _RARITY_INDEX[r] <= parent_index else r for r in rarities]
+    
+    return tuple(rarities), tuple(cumulative_weights)
+
+
+def weighted_rarity_choice(preferred_rarity: Optional[str] = None, parent_rarity: Optional[str] = None) -> str:
+    """
+    Select a rarity based on weights, with optional bias toward preferred rarity.
+    If parent_rarity is provided, removes all rarities lower than parent and redistributes weights.
+    
+    Args:
+        preferred_rarity: If provided, increases weight by 50% for that rarity
+        parent_rarity: If provided, removes all rarities lower than this and redistributes weights
+        
+    Returns:
+        Selected rarity string
+    """
+    rarities, cumulative_weights = _rarity_weight_table(preferred_rarity, parent_rarity)
     
     if not cumulative_weights or cumulative_weights[-1] == 0:
-        # No valid weights - return parent rarity or highest
+        # Fallback: if all weights are zero, use parent rarity or highest available
         if parent_rarity:
             return parent_rarity
-        return list(RARITY_WEIGHTS.keys())[-1]
+        return _RARITY_ORDER[-1]
+    
+    # Select based on random value (random.choices does the bisect in C)
+    return random.choices(rarities, cum_weights=cumulative_weights, k=1)[0]
+
+
+def sample_rarities(count: int, preferred_rarity: Optional[str] = None, parent_rarity: Optional[str] = None) -> List[str]:
+    """
+    Select many rarities at once with the same rules as weighted_rarity_choice.
+    Draws all samples in a single random.choices call; use when generating classes in bulk.
+    
+    Args:
+        count: Number of rarities to draw
+        preferred_rarity: If provided, increases weight by 50% for that rarity
+        parent_rarity: If provided, removes all rarities lower than this and redistributes weights
+        
+    Returns:
+        List of count selected rarity strings
+    """
+    rarities, cumulative_weights = _rarity_weight_table(preferred_rarity, parent_rarity)
     
-    # Select based on random value
-    rand = random.uniform(0, cumulative_weights[-1])
-    for i, weight in enumerate(cumulative_weights):
-        if rand <= weight:
-            selected_rarity = rarities[i]
-            # Final safety: verify selected rarity is >= parent_rarity
-            if parent_rarity and parent_rarity in RARITY_WEIGHTS:
-                rarity_order = list(RARITY_WEIGHTS.keys())
-                if selected_rarity in rarity_order:
-                    selected_index = rarity_order.index(selected_rarity)
-                    parent_index = rarity_order.index(parent_rarity)
-                    if selected_index < parent_index:
-                        # Selected rarity is lower than parent - return parent instead
-                        return parent_rarity
-                    # SPECIAL RULE: After Unique, must be strictly higher (not same)
-                    unique_index = rarity_order.index("Unique") if "Unique" in rarity_order else 5
-                    if parent_index >= unique_index and selected_index <= parent_index:
-                        # Parent is Unique or higher, but child is same or lower - force higher
-                        if parent_index < len(rarity_order) - 1:
-                            return rarity_order[parent_index + 1]
-                        else:
-                            return parent_rarity  # Can't go higher
-            return selected_rarity
+    if not cumulative_weights or cumulative_weights[-1] == 0:
+        return [parent_rarity or _RARITY_ORDER[-1]] * count
     
-    # Fallback to last valid rarity
-    selected_rarity = rarities[-1]
-    # Final safety check
-    if parent_rarity and parent_rarity in RARITY_WEIGHTS:
-        rarity_order = list(RARITY_WEIGHTS.keys())
-        if selected_rarity in rarity_order:
-            selected_index = rarity_order.index(selected_rarity)
-            parent_index = rarity_order.index(parent_rarity)
-            if selected_index < parent_index:
-                return parent_rarity
-            # SPECIAL RULE: After Unique, must be strictly higher (not same)
-            unique_index = rarity_order.index("Unique") if "Unique" in rarity_order else 5
-            if parent_index >= unique_index and selected_index <= parent_index:
-                # Parent is Unique or higher, but child is same or lower - force higher
-                if parent_index < len(rarity_order) - 1:
-                    return rarity_order[parent_index + 1]
-                else:
-                    return parent_rarity  # Can't go higher
-    return selected_rarity
+    return random.choices(rarities, cum_weights=cumulative_weights, k=count)
 
 
 def random_adjective() -> str:
@@ -169,6 +164,24 @@ def generate_class_id(template_key: str) -> str:
     return f"class_{template_key}_{adj}"
 
 
+def generate_hex_ids(count: int) -> List[str]:
+    """
+    Generate random 8-character hex IDs in one batch.
+    Reads all random bytes with a single os.urandom call instead of one uuid4 per ID.
+    """
+    random_bytes = os.urandom(4 * count)
+    return [random_bytes[i:i + 4].hex() for i in range(0, 4 * count, 4)]
+
+
+def generate_sortable_id() -> str:
+    """
+    Generate a time-ordered 128-bit ID (ULID layout) as a 32-character hex string.
+    The first 48 bits are the millisecond timestamp and the remaining 80 are random,
+    so new primary keys land at the end of the index instead of at random positions.
+    """
+    return f"{time.time_ns() // 1_000_000:012x}{os.urandom(10).hex()}"
+
+
 def rarity_to_stat_multiplier(rarity: str) -> float:
     """
     Convert rarity to stat multiplier for balancing.
@@ -0,0 +1,36 @@
+"""Shared test fixtures"""
+import random
+from functools import lru_cache
+
+import pytest
+from app.generator import generate_class
+
+
+@lru_cache(maxsize=None)
+def _cached_generate_class(template_key, unlock_condition_id, preferred_rarity, force_exact_rarity):
+    """Generate a class with a fixed seed derived from the arguments, once per argument set"""
+    state = random.getstate()
+    # String seeds are stable across runs (unlike hash(), which is salted per process)
+    random.seed(f"{template_key}:{unlock_condition_id}:{preferred_rarity}")
+    try:
+        return generate_class(template_key, unlock_condition_id, preferred_rarity,
+                              force_exact_rarity=force_exact_rarity)
+    finally:
+        random.setstate(state)
+
+
+@pytest.fixture
+def make_class():
+    """
+    Get a helper that returns a deterministic, memoized generated class.
+    Results are shared between tests, so they must not be mutated.
+    """
+    def _make_class(template_key, unlock_condition_id="test", preferred_rarity=None, force_exact_rarity=False):
+        return _cached_generate_class(template_key, unlock_condition_id, preferred_rarity, force_exact_rarity)
+    return _make_class
+
+
+@pytest.fixture(autouse=True)
+def seed_random():
+    """Seed the global RNG before every test so results are reproducible"""
+    random.seed(0)
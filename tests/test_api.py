@@ -1,8 +1,9 @@
 """Tests for API endpoints"""
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from app.database import Base, get_db
 from app.main import app
 
@@ -10,7 +11,20 @@ from app.main import app
 @pytest.fixture
 def db_session():
     """Create a test database session"""
-    engine = create_engine("sqlite:///:memory:")
+    # One shared in-memory connection, usable from the TestClient's worker threads
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
+    
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=MEMORY")
+        cursor.execute("PRAGMA synchronous=OFF")
+        cursor.close()
+    
     Base.metadata.create_all(engine)
     TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     session = TestingSessionLocal()
@@ -127,14 +141,17 @@ def test_event_triggers_class_generation(client):
     """Test that ingesting enough events triggers class generation"""
     user_id = "test_player_auto_unlock"
     
-    # Ingest exactly 10000 book reading events (should trigger unlock)
-    for i in range(10000):
-        response = client.post("/events", json={
+    # Ingest exactly 10000 book reading events in one batch (should trigger unlock)
+    response = client.post("/events/batch", json=[
+        {
             "user_id": user_id,
             "event_name": "read_book",
             "metadata": {"book_id": f"book_{i}"}
-        })
-        assert response.status_code == 200
+        }
+        for i in range(10000)
+    ])
+    assert response.status_code == 200
+    assert response.json()["ingested"] == 10000
     
     # Check that class was unlocked
     response = client.get(f"/player/{user_id}/classes")
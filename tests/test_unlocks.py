@@ -1,110 +1,149 @@
 """Tests for unlock engine"""
+import re
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
 from app.database import Base, get_db
 from app.models import Player, Event, PlayerStats, PlayerClass
+from app.rules import get_rules
 from app.unlock_engine import check_unlocks, evaluate_rule, get_player_stats
-from app.event_service import ingest_event
+from app.utils import RARITY_WEIGHTS
+from app.event_service import backfill_event_aggs, ingest_event, ingest_events
 
 
-@pytest.fixture
-def db_session():
-    """Create a test database session"""
-    engine = create_engine("sqlite:///:memory:")
+@pytest.fixture(scope="module")
+def db_engine():
+    """Create one in-memory database (and schema) shared by the module's tests"""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
+    
+    @event.listens_for(engine, "connect")
+    def _configure_sqlite(dbapi_connection, connection_record):
+        # pysqlite doesn't emit BEGIN itself, which breaks SAVEPOINTs; let SQLAlchemy manage transactions
+        dbapi_connection.isolation_level = None
+        # Test data is throwaway - skip durability work on commit
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA synchronous=OFF")
+        cursor.execute("PRAGMA journal_mode=MEMORY")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA locking_mode=EXCLUSIVE")
+        cursor.close()
+    
+    @event.listens_for(engine, "begin")
+    def _emit_begin(connection):
+        connection.exec_driver_sql("BEGIN")
+    
     Base.metadata.create_all(engine)
-    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    session = TestingSessionLocal()
+    try:
+        yield engine
+    finally:
+        Base.metadata.drop_all(engine)
+        engine.dispose()
+
+
+@pytest.fixture
+def db_session(db_engine):
+    """Create a test database session whose changes are rolled back after each test"""
+    connection = db_engine.connect()
+    transaction = connection.begin()
+    # Commits inside the code under test only release a SAVEPOINT in the outer transaction
+    session = Session(bind=connection, autoflush=False, join_transaction_mode="create_savepoint")
     try:
         yield session
     finally:
         session.close()
-        Base.metadata.drop_all(engine)
+        transaction.rollback()
+        connection.close()
 
 
-def test_read_10000_books_unlock(db_session):
-    """Test that reading 10,000 books unlocks 'The Wise One' class"""
-    user_id = "test_player_1"
-    
-    # Ingest 10,000 book reading events
-    for i in range(10000):
-        ingest_event(
-            db=db_session,
-            user_id=user_id,
-            event_name="read_book",
-            metadata={"book_id": f"book_{i}"}
-        )
-    
-    # Check that class was unlocked
-    classes = db_session.query(PlayerClass).filter(PlayerClass.user_id == user_id).all()
-    assert len(classes) > 0
-    
-    # Check that it's a bookworm class
-    bookworm_class = None
-    for pc in classes:
-        if pc.unlock_condition_id == "unlock_read_10000":
-            bookworm_class = pc
-            break
-    
-    assert bookworm_class is not None
-    assert "bookworm" in bookworm_class.class_data["id"] or "wise" in bookworm_class.class_data["name"].lower()
-    assert bookworm_class.class_data["rarity"] in ["Epic", "Unique", "Legendary", "Mythic", "God", "Forbidden"]
+def _bulk_ingest(db, user_id, event_name, metadatas):
+    """Ingest one event per metadata dict in a single transaction (unlocks are checked once)"""
+    ingest_events(db, [
+        {"user_id": user_id, "event_name": event_name, "metadata": metadata}
+        for metadata in metadatas
+    ])
 
 
-def test_kill_5000_monsters_unlock(db_session):
-    """Test that killing 5,000 monsters unlocks 'The Slayer' class"""
-    user_id = "test_player_2"
-    
-    # Ingest 5,000 monster kill events
-    for i in range(5000):
-        ingest_event(
-            db=db_session,
-            user_id=user_id,
-            event_name="kill_monster",
-            metadata={"monster_id": f"monster_{i}"}
-        )
+# (user_id, event_name, metadata key, value prefix, event count, unlock rule, id substring, name pattern, allowed rarities)
+# Name patterns are precompiled case-insensitive regexes, so no lowercased copy of the name is built
+THRESHOLD_UNLOCK_CASES = [
+    # Reading 10,000 books unlocks 'The Wise One'
+    ("test_player_1", "read_book", "book_id", "book", 10000, "unlock_read_10000", "bookworm", re.compile("wise", re.IGNORECASE)),
+    # Killing 5,000 monsters unlocks 'The Slayer'
+    ("test_player_2", "kill_monster", "monster_id", "monster", 5000, "unlock_kill_5000", "slayer", re.compile("slayer", re.IGNORECASE)),
+    # Crafting 100 unique items unlocks 'The Tinkerer'
+    ("test_player_3", "craft_item", "crafted_item_id", "item", 100, "unlock_craft_100_unique", "tinkerer", re.compile("tinkerer", re.IGNORECASE)),
+]
+
+
+@pytest.mark.parametrize(
+    "user_id,event_name,meta_key,value_prefix,count,unlock_id,id_substr,name_pattern",
+    THRESHOLD_UNLOCK_CASES,
+    ids=[case[1] for case in THRESHOLD_UNLOCK_CASES]
+)
+def test_threshold_unlock(db_session, user_id, event_name, meta_key, value_prefix, count,
+                          unlock_id, id_substr, name_pattern):
+    """Test that reaching a rule's threshold unlocks its class"""
+    _bulk_ingest(db_session, user_id, event_name, [{meta_key: f"{value_prefix}_{i}"} for i in range(count)])
     
     # Check that class was unlocked
     classes = db_session.query(PlayerClass).filter(PlayerClass.user_id == user_id).all()
     assert len(classes) > 0
     
-    # Check that it's a slayer class
-    slayer_class = None
-    for pc in classes:
-        if pc.unlock_condition_id == "unlock_kill_5000":
-            slayer_class = pc
-            break
+    unlocked_class = next((pc for pc in classes if pc.unlock_condition_id == unlock_id), None)
     
-    assert slayer_class is not None
-    assert "slayer" in slayer_class.class_data["id"] or "slayer" in slayer_class.class_data["name"].lower()
+    assert unlocked_class is not None
+    assert id_substr in unlocked_class.class_data["id"] or name_pattern.search(unlocked_class.class_data["name"])
+    # The rule's rarity only weights the roll, so any rarity can come out
+    assert unlocked_class.class_data["rarity"] in RARITY_WEIGHTS
 
 
-def test_craft_100_unique_items_unlock(db_session):
-    """Test that crafting 100 unique items unlocks 'The Tinkerer' class"""
-    user_id = "test_player_3"
+def test_deferred_unlock_check(db_session):
+    """Test ingesting events without per-event unlock checks, then checking once"""
+    user_id = "test_player_deferred"
     
-    # Ingest 100 unique craft events
     for i in range(100):
         ingest_event(
             db=db_session,
             user_id=user_id,
             event_name="craft_item",
-            metadata={"crafted_item_id": f"item_{i}"}
+            metadata={"crafted_item_id": f"item_{i}"},
+            check_unlocks_after=False
         )
+    assert db_session.query(PlayerClass).filter(PlayerClass.user_id == user_id).count() == 0
     
-    # Check that class was unlocked
+    newly_unlocked = check_unlocks(db_session, user_id)
+    assert len(newly_unlocked) == 1
     classes = db_session.query(PlayerClass).filter(PlayerClass.user_id == user_id).all()
-    assert len(classes) > 0
-    
-    # Check that it's a tinkerer class
-    tinkerer_class = None
-    for pc in classes:
-        if pc.unlock_condition_id == "unlock_craft_100_unique":
-            tinkerer_class = pc
-            break
-    
-    assert tinkerer_class is not None
-    assert "tinkerer" in tinkerer_class.class_data["id"] or "tinkerer" in tinkerer_class.class_data["name"].lower()
+    assert [pc.unlock_condition_id for pc in classes] == ["unlock_craft_100_unique"]
+
+
+def test_backfill_event_aggs(db_session):
+    """Test legacy PlayerStats blobs are carried over to the aggregate table"""
+    user_id = "test_player_legacy"
+    db_session.add(Player(id=user_id))
+    db_session.add(PlayerStats(user_id=user_id, event_counts={
+        "craft_item": {"count": 3, "distinct_count": 2, "distinct_values": ["item_a", "item_b"]}
+    }))
+    db_session.commit()
+    
+    assert backfill_event_aggs(db_session) == 1
+    assert backfill_event_aggs(db_session) == 0
+    assert get_player_stats(db_session, user_id) == {"craft_item": {"count": 3, "distinct_count": 2}}
+    
+    # New events build on the backfilled counts
+    ingest_event(db_session, user_id, "craft_item", {"crafted_item_id": "item_a"}, check_unlocks_after=False)
+    ingest_event(db_session, user_id, "craft_item", {"crafted_item_id": "item_c"}, check_unlocks_after=False)
+    assert get_player_stats(db_session, user_id) == {"craft_item": {"count": 5, "distinct_count": 3}}
+
+
+# Shared distinct_values for the rule evaluation cases (only read, never mutated)
+_NO_VALUES = frozenset()
+_FIVE_VALUES = frozenset("abcde")
 
 
 def test_rule_evaluation():
@@ -118,12 +157,12 @@ def test_rule_evaluation():
     
     # Test count aggregation
     player_stats = {
-        "test_event": {"count": 15, "distinct_count": 5, "distinct_values": set()}
+        "test_event": {"count": 15, "distinct_count": 5, "distinct_values": _NO_VALUES}
     }
     assert evaluate_rule(rule, player_stats) == True
     
     player_stats = {
-        "test_event": {"count": 5, "distinct_count": 5, "distinct_values": set()}
+        "test_event": {"count": 5, "distinct_count": 5, "distinct_values": _NO_VALUES}
     }
     assert evaluate_rule(rule, player_stats) == False
     
@@ -136,7 +175,17 @@ def test_rule_evaluation():
     }
     
     player_stats = {
-        "test_event": {"count": 10, "distinct_count": 5, "distinct_values": set(["a", "b", "c", "d", "e"])}
+        "test_event": {"count": 10, "distinct_count": 5, "distinct_values": _FIVE_VALUES}
     }
     assert evaluate_rule(rule_distinct, player_stats) == True
 
+
+def test_compiled_rule_checks_match_evaluate_rule():
+    """Test that precompiled rule checks agree with evaluate_rule"""
+    for rule in get_rules():
+        event_name = rule["match"]["event_name"]
+        threshold = rule["threshold"]
+        for value in (0, threshold - 1, threshold):
+            player_stats = {event_name: {"count": value, "distinct_count": value}}
+            assert rule["_check"](player_stats) == evaluate_rule(rule, player_stats)
+        assert rule["_check"]({}) == False